@@ -1,39 +1,161 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, Response
 from contextlib import asynccontextmanager
 from fastapi.staticfiles import StaticFiles
 from src.config import settings
-from pymongo import AsyncMongoClient
+from bson import ObjectId
+from pymongo import AsyncMongoClient, UpdateOne
 from beanie import init_beanie
 
 from src.minio import init_minio_client
 from src.models.conversation import Conversation, Message
-from src.models.payament import Payment
+from src.models.payament import Payment, ChargilyWebhookEvent
+from src.models.response_cache import CachedResponse
+from src.models.stored_file import StoredBlob, StoredFile
 from src.router.payment_router import router as payment_router
 from src.router.ai_agent_router import router as ai_agent_router
+from src.router.files_router import router as files_router
+from src.services.ai_agent_service import get_ai_agent_service
+from src.services.chargily_service import get_chargily_service
+from src.services.payment_reconciler import payment_reconciler
+from src.services.webhook_inbox import webhook_inbox
+from src.services.checkout_link_worker import checkout_link_worker
+from src.services.image_variants import image_variant_renderer
+from src.metrics import MongoCommandListener, event_loop_lag_monitor, MetricsMiddleware, metrics_response
+from src.tracing import MongoTracingListener, setup_tracing, shutdown_tracing, TracingMiddleware
+from src.readiness import ReadinessMiddleware, readiness_gate
+from src.services.health_service import health_service
 from fastapi.middleware.cors import CORSMiddleware
 
 
-mongo_client = AsyncMongoClient(settings.mongodb_url)
+setup_tracing()
+
+mongo_client = AsyncMongoClient(
+    settings.mongodb_url,
+    event_listeners=[MongoCommandListener(), MongoTracingListener()]
+)
 mongo_db = mongo_client[settings.mongodb_database]
 
 
 async def init_mongo():
     await init_beanie(
         database=mongo_db, 
-        document_models=[Conversation, Message, Payment]
+        document_models=[Conversation, Message, Payment, ChargilyWebhookEvent, CachedResponse, StoredBlob, StoredFile]
     )
+    await backfill_conversation_sort_ids()
+
+
+async def backfill_conversation_sort_ids():
+    """Give conversations stored before sort_id existed one, they'd be skipped by pagination"""
+    
+    collection = Conversation.get_pymongo_collection()
+    while True:
+        missing = await collection.find({"sort_id": {"$exists": False}}, {"_id": 1}).limit(1000).to_list()
+        if not missing:
+            return
+        await collection.bulk_write(
+            [
+                UpdateOne({"_id": document["_id"], "sort_id": {"$exists": False}}, {"$set": {"sort_id": ObjectId()}})
+                for document in missing
+            ],
+            ordered=False
+        )
+
+
+async def warm_up_agent():
+    # Building the service compiles the graph, loading the tokenizer may download it, keep both off the loop
+    ai_agent_service = await asyncio.to_thread(get_ai_agent_service)
+    await asyncio.to_thread(ai_agent_service.load_encoding)
+    if settings.warmup_llm:
+        await ai_agent_service.warm_up()
+
+
+async def init_dependencies():
+    """Connect to the required dependencies, concurrently"""
+    
+    tasks = [
+        init_mongo(),
+        init_minio_client(
+            minio_host=settings.minio_endpoint.split(':')[0],
+            minio_port=int(settings.minio_endpoint.split(':')[1]),
+            minio_root_user=settings.minio_access_key,
+            minio_root_password=settings.minio_secret_key
+        )
+    ]
+    if settings.chargily_configured:
+        tasks.append(get_chargily_service().start())
+    await asyncio.gather(*tasks)
+
+
+async def init_dependencies_with_retry():
+    """Retry with backoff while the dependencies come up, raises after the last attempt"""
+    
+    for attempt in range(1, settings.startup_max_attempts + 1):
+        try:
+            await init_dependencies()
+            return
+        except Exception as e:
+            if attempt == settings.startup_max_attempts:
+                raise
+            delay = min(settings.startup_retry_base_seconds * 2 ** (attempt - 1), settings.startup_retry_max_seconds)
+            print(f"Startup attempt {attempt} failed: {e}, retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+
+async def warm_up():
+    """Initialize dependencies concurrently, then start the workers and open the readiness gate"""
+    
+    # Pre-warming is best effort, a failure only costs the first request a new connection
+    optional_tasks = [warm_up_agent()]
+    if settings.warmup_chargily and settings.chargily_configured:
+        optional_tasks.append(get_chargily_service().warm_up())
+    
+    try:
+        results = await asyncio.gather(
+            init_dependencies_with_retry(),
+            *optional_tasks,
+            return_exceptions=True
+        )
+        if isinstance(results[0], Exception):
+            raise results[0]
+        for result in results[1:]:
+            if isinstance(result, Exception):
+                print(f"Warm-up step failed: {result}")
+        
+        if settings.payment_reconciler_enabled:
+            await payment_reconciler.start()
+        await webhook_inbox.start()
+        await checkout_link_worker.start()
+        if settings.health_deep_check_enabled:
+            await health_service.start()
+    except Exception as e:
+        # Liveness fails from here on so the orchestrator restarts the process
+        print(f"Startup failed: {e}")
+        readiness_gate.fail(e)
+        return
+    
+    readiness_gate.open()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_mongo()
-    await init_minio_client(
-        minio_host=settings.minio_endpoint.split(':')[0],
-        minio_port=int(settings.minio_endpoint.split(':')[1]),
-        minio_root_user=settings.minio_access_key,
-        minio_root_password=settings.minio_secret_key
-    )
+    await event_loop_lag_monitor.start()
+    
+    # The server accepts connections right away, requests wait on the readiness gate
+    warm_up_task = asyncio.create_task(warm_up())
     yield
+    
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+    await health_service.stop()
+    await checkout_link_worker.stop()
+    await webhook_inbox.stop()
+    await payment_reconciler.stop()
+    if settings.chargily_configured:
+        await get_chargily_service().close()
+    image_variant_renderer.shutdown()
+    await event_loop_lag_monitor.stop()
+    shutdown_tracing()
 
 
 app = FastAPI(
@@ -42,27 +164,51 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Pure ASGI layers, the last added is the outermost: the readiness 503s get CORS headers, metrics and a span
+app.add_middleware(ReadinessMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.allowed_origins_list, 
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],  
+    expose_headers=["X-Next-Cursor", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
 # Include routers
 app.include_router(payment_router, prefix="/api")
 app.include_router(ai_agent_router, prefix="/api")
+app.include_router(files_router, prefix="/api")
 
-# Health check endpoint
+# Liveness: the process is up and its event loop answers, dependencies are not checked.
+# A startup that gave up fails it, restarting is the only way out.
 @app.get("/health")
-async def health_check():
+@app.get("/health/live")
+async def health_check(response: Response):
+    if readiness_gate.failed:
+        response.status_code = 503
+        return {"status": "startup_failed", "error": readiness_gate.error}
     return {
         "status": "healthy",
         "service": "carvane-ai-backend",
         "version": settings.app_version
     }
 
+# Readiness: started, with Mongo and MinIO reachable (checks are cached for a few seconds)
+@app.get("/health/ready")
+async def readiness_check(response: Response):
+    report = await health_service.readiness()
+    if not report["ready"]:
+        response.status_code = 503
+    return report
+
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -0,0 +1,83 @@
+"""Benchmark Bucket.put against a local MinIO, per file size.
+
+Compares the size-aware upload path with the previous unknown-length sequential one.
+
+Run with: python -m scripts.bench_minio_upload --endpoint localhost:9000
+"""
+import argparse
+import asyncio
+import io
+import os
+import time
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+SIZES_MB = [0.25, 1, 4, 16, 64, 128]
+
+
+def make_upload(data: bytes, known_size: bool) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data) if known_size else None,
+        filename="bench.bin",
+        headers=Headers({"content-type": "application/octet-stream"}),
+    )
+
+
+async def legacy_put(bucket, file: UploadFile, object_name: str) -> None:
+    """Upload the way Bucket.put did before: unknown length, 10 MiB sequential parts"""
+    await bucket.client.put_object(
+        bucket_name=bucket.bucket_name,
+        object_name=f"{bucket.file_prefix}/{object_name}",
+        data=file.file,
+        length=-1,
+        part_size=10 * 1024 * 1024,
+        num_parallel_uploads=1,
+        content_type=file.content_type,
+        metadata={"filename": file.filename},
+    )
+
+
+async def run(endpoint: str, access_key: str, secret_key: str, repeat: int) -> None:
+    from src.minio import DocumentBucket, init_minio_client
+
+    host, port = endpoint.split(":")
+    await init_minio_client(host, int(port), access_key, secret_key)
+    bucket = DocumentBucket("bench")
+
+    print(f"{'size':>10} {'legacy MB/s':>12} {'size-aware MB/s':>16}")
+    for size_mb in SIZES_MB:
+        data = os.urandom(int(size_mb * 1024 * 1024))
+        results = {}
+        for mode in ("legacy", "size-aware"):
+            started = time.perf_counter()
+            for index in range(repeat):
+                object_name = f"{mode}-{size_mb}-{index}"
+                if mode == "legacy":
+                    await legacy_put(bucket, make_upload(data, known_size=False), object_name)
+                else:
+                    await bucket.put(make_upload(data, known_size=True), object_name)
+            elapsed = time.perf_counter() - started
+            results[mode] = size_mb * repeat / elapsed
+            for index in range(repeat):
+                await bucket.delete(f"{mode}-{size_mb}-{index}")
+        print(f"{size_mb:>8} MB {results['legacy']:>12.1f} {results['size-aware']:>16.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--endpoint", default="localhost:9000")
+    parser.add_argument("--access-key", default="minioadmin")
+    parser.add_argument("--secret-key", default="minioadmin123")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Allow the largest benchmark size
+    os.environ.setdefault("MINIO_MAX_UPLOAD_SIZE_MB", str(int(max(SIZES_MB)) + 1))
+
+    asyncio.run(run(args.endpoint, args.access_key, args.secret_key, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
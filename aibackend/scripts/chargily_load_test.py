@@ -0,0 +1,70 @@
+"""Load-test the pooled Chargily client against the local stand-in server.
+
+Run with: python -m scripts.chargily_load_test --base-url http://localhost:8099
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+
+async def run(requests: int, concurrency: int) -> None:
+    from src.models.payament import ChargilyPaymentRequest
+    from src.services.chargily_service import ChargilyService
+
+    service = ChargilyService()
+    await service.start()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def create_one(index: int) -> None:
+        nonlocal errors
+        request = ChargilyPaymentRequest(
+            amount=1500.0,
+            success_url="http://localhost/success",
+            failure_url="http://localhost/failure",
+            webhook_url="http://localhost/webhook",
+            invoice_number=f"LOAD-{index}"
+        )
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await service.create_payment(request, f"load-{index}")
+            except Exception as e:
+                errors += 1
+                print(f"Request {index} failed: {e}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(create_one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    stats = service.pool_stats()
+    await service.close()
+
+    latencies.sort()
+    print(f"requests:    {requests} ({errors} errors) in {elapsed:.2f}s -> {requests / elapsed:.1f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"pool:        {stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8099")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    # Settings are read at import time
+    os.environ["CHARGILY_BASE_URL"] = args.base_url
+    os.environ.setdefault("CHARGILY_API_KEY", "stub-api-key")
+    os.environ.setdefault("CHARGILY_SECRET_KEY", "stub-secret-key")
+
+    asyncio.run(run(args.requests, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
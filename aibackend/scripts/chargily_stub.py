@@ -0,0 +1,79 @@
+"""Local stand-in for the Chargily invoice API.
+
+Run with: uvicorn scripts.chargily_stub:app --port 8099
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from fastapi import FastAPI, HTTPException, Request
+
+LATENCY_MS = float(os.getenv("CHARGILY_STUB_LATENCY_MS", "100"))
+JITTER_MS = float(os.getenv("CHARGILY_STUB_JITTER_MS", "50"))
+
+app = FastAPI(title="Chargily stub")
+
+invoices: Dict[str, Dict[str, Any]] = {}
+connections: set[str] = set()
+
+
+async def simulate_latency() -> None:
+    await asyncio.sleep(max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+
+
+def track_connection(request: Request) -> None:
+    if request.client:
+        connections.add(f"{request.client.host}:{request.client.port}")
+
+
+@app.post("/invoices")
+async def create_invoice(request: Request) -> dict:
+    track_connection(request)
+    data = await request.json()
+    await simulate_latency()
+
+    invoice_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    invoice = {
+        "checkout_url": f"http://localhost:8099/checkout/{invoice_id}",
+        "invoice_id": invoice_id,
+        "invoice_number": data.get("invoice_number", invoice_id),
+        "amount": data["amount"],
+        "currency": data.get("currency", "DZD"),
+        "status": "pending",
+        "payment_method": data.get("payment_method", "EDAHABIA"),
+        "created_at": now.isoformat(),
+        "expires_at": (now + timedelta(hours=24)).isoformat()
+    }
+    invoices[invoice_id] = invoice
+    return invoice
+
+
+@app.get("/invoices/{invoice_id}")
+async def get_invoice(invoice_id: str, request: Request) -> dict:
+    track_connection(request)
+    await simulate_latency()
+
+    invoice = invoices.get(invoice_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice
+
+
+@app.post("/invoices/{invoice_id}/pay")
+async def pay_invoice(invoice_id: str) -> dict:
+    """Mark an invoice as paid, for end-to-end testing"""
+    invoice = invoices.get(invoice_id)
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    invoice["status"] = "paid"
+    return invoice
+
+
+@app.get("/stats")
+async def stats() -> dict:
+    """Number of invoices and distinct client connections seen"""
+    return {"invoices": len(invoices), "client_connections": len(connections)}
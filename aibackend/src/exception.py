@@ -45,6 +45,21 @@ class NotFound(BaseAPIException):
         super().__init__(404, detail)
 
 
+class PayloadTooLarge(BaseAPIException):
+    """413 Payload Too Large"""
+    
+    def __init__(self, detail: str = "Payload Too Large"):
+        super().__init__(413, detail)
+
+
+class TooManyRequests(BaseAPIException):
+    """429 Too Many Requests"""
+    
+    def __init__(self, detail: str = "Too Many Requests", retry_after: Optional[int] = None):
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        super().__init__(429, detail, headers)
+
+
 class InternalServerError(BaseAPIException):
     """500 Internal Server Error"""
     
@@ -58,4 +73,6 @@ class exceptions:
     Unauthorized = Unauthorized
     Forbidden = Forbidden
     NotFound = NotFound
+    PayloadTooLarge = PayloadTooLarge
+    TooManyRequests = TooManyRequests
     InternalServerError = InternalServerError
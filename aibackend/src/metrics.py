@@ -0,0 +1,189 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from fastapi import Response
+from opentelemetry import trace
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import settings
+from src.tracing import tracer
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DEPENDENCY_DURATION = Histogram(
+    "dependency_call_duration_seconds",
+    "Latency of calls to Mongo, OpenAI, Chargily and MinIO",
+    ["dependency", "operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the LLM provider",
+    ["model", "kind"],
+)
+
+AGENT_NODE_DURATION = Histogram(
+    "agent_node_duration_seconds",
+    "Duration of each LangGraph node of the AI agent",
+    ["node"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "LLM calls waiting for a slot",
+    ["model"],
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time LLM calls waited for a slot",
+    ["model", "priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a loop callback was due and when it ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+EVENT_LOOP_LAG_LAST = Gauge(
+    "event_loop_lag_last_seconds",
+    "Most recent event loop lag sample",
+)
+
+
+@contextmanager
+def track_dependency(dependency: str, operation: str) -> Iterator[None]:
+    """Time and trace a call to an external dependency, labelled by outcome"""
+    
+    started = time.perf_counter()
+    outcome = "success"
+    with tracer.start_as_current_span(
+        f"{dependency} {operation}",
+        kind=trace.SpanKind.CLIENT,
+        attributes={"peer.service": dependency, "operation": operation},
+    ):
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            DEPENDENCY_DURATION.labels(dependency, operation, outcome).observe(
+                time.perf_counter() - started
+            )
+
+
+def record_token_usage(model: str, usage: Optional[dict]) -> int:
+    """Count the tokens of one LLM response, returns the total"""
+    
+    if not usage:
+        return 0
+    
+    input_tokens = usage.get("input_tokens", 0)
+    output_tokens = usage.get("output_tokens", 0)
+    LLM_TOKENS.labels(model, "prompt").inc(input_tokens)
+    LLM_TOKENS.labels(model, "completion").inc(output_tokens)
+    return usage.get("total_tokens", input_tokens + output_tokens)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command the Mongo driver sends, including the ones issued by Beanie"""
+    
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+    
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        DEPENDENCY_DURATION.labels("mongo", event.command_name, "success").observe(
+            event.duration_micros / 1_000_000
+        )
+    
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        DEPENDENCY_DURATION.labels("mongo", event.command_name, "error").observe(
+            event.duration_micros / 1_000_000
+        )
+
+
+class MetricsMiddleware:
+    """Record the latency of each request under its route template, body streaming included"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope, use its template to keep labels bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(scope["method"], route_path, str(status)).observe(
+                time.perf_counter() - started
+            )
+
+
+def metrics_response() -> Response:
+    """Current metrics in the Prometheus text format"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+class EventLoopLagMonitor:
+    """Samples how late the event loop runs a periodic wake-up"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+
+
+# Global instance
+event_loop_lag_monitor = EventLoopLagMonitor(interval=settings.event_loop_lag_interval_seconds)
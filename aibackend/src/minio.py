@@ -0,0 +1,860 @@
+import asyncio
+import io
+import random
+import string
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+import aiofiles
+from fastapi import UploadFile
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from miniopy_async.error import S3Error  # type: ignore
+from miniopy_async.api import Minio  # type: ignore
+from miniopy_async.datatypes import PostPolicy  # type: ignore
+from miniopy_async.deleteobjects import DeleteObject  # type: ignore
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src.config import settings
+from src.utils import (
+    SizeLimitedReader,
+    check_extension,
+    etag_matches,
+    get_file_size,
+    HashingReader,
+    is_allowed_file,
+    parse_range_header,
+)
+from src.exception import exceptions
+from src.models.stored_file import StoredBlob, StoredFile
+from src.services.object_cache import object_disk_cache
+from src.metrics import track_dependency
+from src.services.image_variants import (
+    RASTER_CONTENT_TYPES,
+    VARIANT_CACHE_CONTROL,
+    VARIANTS,
+    image_variant_renderer,
+    variant_object_name,
+)
+
+IMAGES_BUCKET_NAME = "images"
+DOCUMENTS_BUCKET_NAME = "documents"
+WA_SIM_BUCKET_NAME = "wa-sim"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024
+# Content-addressed blobs, shared by every prefix of a bucket
+BLOBS_PREFIX = "blobs"
+BLOB_CLAIM_ATTEMPTS = 8
+
+async def init_minio_client(
+    minio_host: str, minio_port: int, minio_root_user: str, minio_root_password: str
+):
+    Bucket.client = Minio(
+        f"{minio_host}:{minio_port}",
+        access_key=minio_root_user,
+        secret_key=minio_root_password,
+        secure=False,
+    )
+
+    # Presigned URLs are signed for the host clients will use
+    Bucket.public_endpoint = settings.minio_public_endpoint or f"{minio_host}:{minio_port}"
+    Bucket.public_secure = settings.minio_public_secure if settings.minio_public_endpoint else False
+    Bucket.presign_client = Minio(
+        Bucket.public_endpoint,
+        access_key=minio_root_user,
+        secret_key=minio_root_password,
+        secure=Bucket.public_secure,
+        region=settings.minio_region,
+    )
+
+    async def ensure_bucket(bucket_name: str) -> None:
+        with track_dependency("minio", "bucket_exists"):
+            exists = await Bucket.client.bucket_exists(bucket_name)
+        if not exists:
+            with track_dependency("minio", "make_bucket"):
+                await Bucket.client.make_bucket(bucket_name)
+
+    await asyncio.gather(
+        *(
+            ensure_bucket(bucket_name)
+            for bucket_name in [IMAGES_BUCKET_NAME, DOCUMENTS_BUCKET_NAME, WA_SIM_BUCKET_NAME]
+        )
+    )
+
+class ObjectInfo:
+    """Metadata of a stored object"""
+
+    def __init__(
+        self, size: int, etag: str, content_type: str, filename: str, key: str | None = None
+    ):
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.filename = filename
+        # Key of the object in the bucket, set by Bucket.stat
+        self.key = key
+
+    @property
+    def etag_header(self) -> str:
+        etag = self.etag.strip('"')
+        return f'"{etag}"'
+
+
+class ObjectStream:
+    """Open object body that is read chunk by chunk"""
+
+    def __init__(self, response, info: ObjectInfo, start: int, end: int):
+        self._response = response
+        self.info = info
+        self.start = start
+        self.end = end
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    async def iter_chunks(self, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._response.close()
+
+
+class Bucket:
+    bucket_name: str
+    file_prefix: str
+    client: Minio
+    presign_client: Minio
+    public_endpoint: str
+    public_secure: bool
+    allowed_extensions: dict[str, list[str]] | None = None
+    # Store each distinct content once, see _put_content_addressed
+    content_addressed: bool = False
+
+    def __init__(self, bucket_name: str, file_prefix: str):
+        self.bucket_name = bucket_name
+        self.file_prefix = file_prefix
+
+    async def put(self, file: UploadFile, object_name: str | None = None) -> str:
+        if object_name is None:
+            object_name = str(uuid.uuid4())
+
+        if file.content_type is None:
+            file.content_type = "application/octet-stream"
+
+        if file.filename is None:
+            file.filename = object_name
+
+        max_size = settings.minio_max_upload_size_mb * 1024 * 1024
+        size = get_file_size(file)
+        if size is not None and size > max_size:
+            raise exceptions.PayloadTooLarge(
+                f"File is larger than {settings.minio_max_upload_size_mb} MB"
+            )
+
+        if self.content_addressed:
+            await self._put_content_addressed(file, object_name, size, max_size)
+        else:
+            await self._put_object(
+                f"{self.file_prefix}/{object_name}",
+                file.file,
+                size,
+                max_size,
+                file.content_type,
+                file.filename,
+            )
+        return object_name
+
+    async def _put_object(
+        self,
+        key: str,
+        data,
+        size: int | None,
+        max_size: int,
+        content_type: str,
+        filename: str,
+    ) -> None:
+        if size is None:
+            # Unknown length: parts are buffered and uploaded one by one
+            length = -1
+            part_size = settings.minio_part_size_mb * 1024 * 1024
+        elif size <= settings.minio_single_put_max_mb * 1024 * 1024:
+            # A single PUT request. part_size must stay above length: with part_size == length
+            # miniopy-async passes the stream itself as the body, which only accepts real files
+            length = size
+            part_size = max(size + 1, MIN_PART_SIZE)
+        else:
+            # Multipart upload with bounded part parallelism
+            length = size
+            part_size = settings.minio_part_size_mb * 1024 * 1024
+
+        object_disk_cache.invalidate(f"{self.bucket_name}/{key}")
+        with track_dependency("minio", "put_object"):
+            await self.client.put_object(
+                bucket_name=self.bucket_name,
+                object_name=key,
+                data=data if isinstance(data, SizeLimitedReader) else SizeLimitedReader(data, max_size),
+                length=length,
+                part_size=part_size,
+                num_parallel_uploads=settings.minio_upload_parallelism,
+                content_type=content_type,
+                metadata={
+                    "filename": filename,
+                },
+            )
+
+    def _blob_key(self, digest: str) -> str:
+        # Blobs stored before each copy had its own key
+        return f"{BLOBS_PREFIX}/{digest}"
+
+    async def _claim_blob(self, digest: str, size: int, content_type: str, object_key: str) -> str:
+        """Take a reference on the blob of a digest, returns the key of the object holding it
+
+        object_key, a freshly uploaded copy, becomes the blob when the digest has none or only
+        a tombstone. Each copy has its own key, so a removal still running on a tombstone that
+        was taken over only deletes the old copy, and its token no longer matches the document.
+        """
+        blobs = StoredBlob.get_pymongo_collection()
+        for attempt in range(BLOB_CLAIM_ATTEMPTS):
+            now = datetime.utcnow()
+            await blobs.update_one(
+                {"bucket_name": self.bucket_name, "digest": digest, "deleting": True},
+                {
+                    "$set": {
+                        "deleting": False,
+                        "ref_count": 0,
+                        "object_key": object_key,
+                        "size": size,
+                        "content_type": content_type,
+                        "updated_at": now,
+                    },
+                    "$unset": {"removal_token": ""},
+                },
+            )
+            try:
+                before = await blobs.find_one_and_update(
+                    {"bucket_name": self.bucket_name, "digest": digest, "deleting": {"$ne": True}},
+                    {
+                        "$inc": {"ref_count": 1},
+                        "$set": {"updated_at": now},
+                        "$setOnInsert": {
+                            "size": size,
+                            "content_type": content_type,
+                            "object_key": object_key,
+                            "deleting": False,
+                            "created_at": now,
+                        },
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
+                )
+            except DuplicateKeyError:
+                # Turned into a tombstone, or inserted concurrently, in between
+                await asyncio.sleep(0.01 * 2 ** attempt)
+                continue
+            if before is None:
+                return object_key
+            return before.get("object_key") or self._blob_key(digest)
+
+        raise exceptions.InternalServerError("Stored content is being removed, please retry")
+
+    async def _put_content_addressed(
+        self, file: UploadFile, object_name: str, size: int | None, max_size: int
+    ) -> None:
+        """Store the upload once per distinct content and point object_name at it
+
+        The content is hashed while it streams to a key of its own. That copy becomes the blob
+        unless the digest already has one, it is then removed again.
+        """
+        upload_key = f"{BLOBS_PREFIX}/{uuid.uuid4().hex}"
+        reader = HashingReader(file.file, max_size)
+        await self._put_object(upload_key, reader, size, max_size, file.content_type, file.filename)
+        digest = reader.digest.hexdigest()
+
+        # A failed claim may still have applied, the copy is left rather than risk removing the blob
+        blob_key = await self._claim_blob(digest, reader.bytes_read, file.content_type, upload_key)
+        if blob_key != upload_key:
+            await self._remove_copy(upload_key)
+
+        try:
+            now = datetime.utcnow()
+            previous = await StoredFile.get_pymongo_collection().find_one_and_update(
+                {"bucket_name": self.bucket_name, "file_prefix": self.file_prefix, "object_name": object_name},
+                {
+                    "$set": {
+                        "digest": digest,
+                        "blob_key": blob_key,
+                        "filename": file.filename,
+                        "content_type": file.content_type,
+                        "size": reader.bytes_read,
+                        "updated_at": now,
+                    },
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+        except BaseException:
+            await asyncio.shield(self._release_blob(digest))
+            raise
+
+        if previous is not None:
+            # The name pointed at a blob before, drop that reference
+            await self._release_blob(previous["digest"])
+
+    async def _remove_copy(self, key: str) -> None:
+        """Remove an uploaded copy whose content already had a blob, a leftover only wastes space"""
+        try:
+            with track_dependency("minio", "remove_object"):
+                await self.client.remove_object(bucket_name=self.bucket_name, object_name=key)
+        except S3Error as e:
+            print(f"Failed to remove duplicate copy {self.bucket_name}/{key}: {e}")
+
+    async def _release_blob(self, digest: str) -> None:
+        """Drop one reference to a blob, removing it with the last one"""
+        blobs = StoredBlob.get_pymongo_collection()
+        blob = await blobs.find_one_and_update(
+            {"bucket_name": self.bucket_name, "digest": digest, "deleting": {"$ne": True}},
+            {"$inc": {"ref_count": -1}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob is None or blob["ref_count"] > 0:
+            return
+
+        # Tombstone first: only one release wins it, a claim taking it over clears the token
+        token = uuid.uuid4().hex
+        marked = await blobs.update_one(
+            {"_id": blob["_id"], "ref_count": {"$lte": 0}, "deleting": {"$ne": True}},
+            {"$set": {"deleting": True, "removal_token": token, "updated_at": datetime.utcnow()}},
+        )
+        if not marked.modified_count:
+            # Claimed again in between
+            return
+
+        key = blob.get("object_key") or self._blob_key(digest)
+        object_disk_cache.invalidate(f"{self.bucket_name}/{key}")
+        with track_dependency("minio", "remove_object"):
+            await self.client.remove_object(bucket_name=self.bucket_name, object_name=key)
+        await blobs.delete_one({"_id": blob["_id"], "removal_token": token})
+
+    async def _lookup(self, object_name: str) -> dict | None:
+        """Content-addressed mapping of a name, None for plain objects"""
+        if not self.content_addressed:
+            return None
+        return await StoredFile.get_pymongo_collection().find_one(
+            {"bucket_name": self.bucket_name, "file_prefix": self.file_prefix, "object_name": object_name}
+        )
+
+    def _object_key(self, object_name: str, stored: dict | None) -> str:
+        # Objects uploaded through presigned forms keep their plain key
+        if stored is not None:
+            return stored.get("blob_key") or self._blob_key(stored["digest"])
+        return f"{self.file_prefix}/{object_name}"
+
+    async def put_bytes(
+        self, data: bytes, object_name: str, content_type: str, filename: str
+    ) -> str:
+        object_disk_cache.invalidate(f"{self.bucket_name}/{self.file_prefix}/{object_name}")
+        with track_dependency("minio", "put_object"):
+            await self.client.put_object(
+                bucket_name=self.bucket_name,
+                object_name=f"{self.file_prefix}/{object_name}",
+                data=io.BytesIO(data),
+                length=len(data),
+                content_type=content_type,
+                metadata={
+                    "filename": filename,
+                },
+            )
+        return object_name
+
+    async def get(self, object_name: str) -> tuple[bytes, str, str]:
+        if settings.object_cache_enabled:
+            return await self._get_cached(object_name)
+
+        stored = await self._lookup(object_name)
+        try:
+            with track_dependency("minio", "get_object"):
+                res = await self.client.get_object(
+                    bucket_name=self.bucket_name,
+                    object_name=self._object_key(object_name, stored),
+                )
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                raise exceptions.NotFound
+            else:
+                raise e
+
+        data = await res.read()
+        content_type = (
+            res.content_type if res.content_type else "application/octet-stream"
+        )
+        filename = res.headers.get("x-amz-meta-filename", f"{object_name}")
+        if stored is not None:
+            filename, content_type = stored["filename"], stored["content_type"]
+
+        res.close()
+        return (data, filename, content_type)
+
+    async def _get_cached(self, object_name: str) -> tuple[bytes, str, str]:
+        """get through the local disk cache, validated against the current ETag"""
+        info = await self.stat(object_name)
+        if not object_disk_cache.cacheable(info.size):
+            return await self._get_uncached(object_name, info)
+
+        cache_key = f"{self.bucket_name}/{info.key}"
+        entry = object_disk_cache.get(cache_key, info.etag)
+        if entry is None:
+            entry = await object_disk_cache.fill(
+                cache_key, info.etag, self._iter_object(object_name, info)
+            )
+
+        if entry is None:
+            return await self._get_uncached(object_name, info)
+
+        async with aiofiles.open(entry.path, "rb") as f:
+            data = await f.read()
+        return (data, info.filename, info.content_type)
+
+    async def _iter_object(self, object_name: str, info: ObjectInfo) -> AsyncIterator[bytes]:
+        # Only opened once iterated, so a fill that joins another one never downloads
+        stream = await self.open(object_name, info=info)
+        async for chunk in stream.iter_chunks():
+            yield chunk
+
+    async def _get_uncached(self, object_name: str, info: ObjectInfo) -> tuple[bytes, str, str]:
+        stream = await self.open(object_name, info=info)
+        data = b"".join([chunk async for chunk in stream.iter_chunks()])
+        return (data, info.filename, info.content_type)
+
+    async def stat(self, object_name: str) -> ObjectInfo:
+        stored = await self._lookup(object_name)
+        key = self._object_key(object_name, stored)
+        try:
+            with track_dependency("minio", "stat_object"):
+                obj = await self.client.stat_object(
+                    bucket_name=self.bucket_name,
+                    object_name=key,
+                )
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                raise exceptions.NotFound
+            else:
+                raise e
+
+        metadata = obj.metadata or {}
+        info = ObjectInfo(
+            size=obj.size,
+            etag=obj.etag,
+            content_type=obj.content_type or "application/octet-stream",
+            filename=metadata.get("x-amz-meta-filename", object_name),
+            key=key,
+        )
+        if stored is not None:
+            info.filename = stored["filename"]
+            info.content_type = stored["content_type"]
+        return info
+
+    async def open(
+        self,
+        object_name: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        info: Optional[ObjectInfo] = None,
+    ) -> ObjectStream:
+        """Open an object, or the inclusive byte range start-end of it, for streaming"""
+        if info is None:
+            info = await self.stat(object_name)
+        if end is None:
+            end = info.size - 1
+
+        try:
+            with track_dependency("minio", "get_object"):
+                res = await self.client.get_object(
+                    bucket_name=self.bucket_name,
+                    object_name=info.key or f"{self.file_prefix}/{object_name}",
+                    offset=start,
+                    length=end - start + 1 if info.size else 0,
+                )
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                raise exceptions.NotFound
+            else:
+                raise e
+
+        return ObjectStream(res, info, start, end)
+
+    async def streaming_response(
+        self,
+        object_name: str,
+        range_header: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+        cache_control: Optional[str] = None,
+    ) -> Response:
+        """Serve an object with constant memory, honoring Range and If-None-Match"""
+        info = await self.stat(object_name)
+        headers = {
+            "Accept-Ranges": "bytes",
+            "ETag": info.etag_header,
+            "Content-Disposition": f"inline; filename*=UTF-8''{quote(info.filename)}",
+        }
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+
+        if etag_matches(if_none_match, info.etag):
+            return Response(status_code=304, headers=headers)
+
+        if object_disk_cache.cacheable(info.size):
+            # Hot objects are sent from local disk, Range is handled by FileResponse
+            cache_key = f"{self.bucket_name}/{info.key}"
+            entry = object_disk_cache.get(cache_key, info.etag)
+            if entry is None:
+                entry = await object_disk_cache.fill(
+                    cache_key, info.etag, self._iter_object(object_name, info)
+                )
+            if entry is not None:
+                return FileResponse(entry.path, media_type=info.content_type, headers=headers)
+
+        try:
+            byte_range = parse_range_header(range_header, info.size)
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{info.size}"},
+            )
+
+        status_code = 200
+        if byte_range is not None:
+            status_code = 206
+            headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{info.size}"
+            stream = await self.open(object_name, byte_range[0], byte_range[1], info=info)
+        else:
+            stream = await self.open(object_name, info=info)
+        headers["Content-Length"] = str(stream.length)
+
+        return StreamingResponse(
+            stream.iter_chunks(),
+            status_code=status_code,
+            media_type=info.content_type,
+            headers=headers,
+        )
+
+    async def presign_upload(
+        self,
+        filename: str,
+        content_type: str,
+        max_size: int | None = None,
+        expires: timedelta | None = None,
+    ) -> dict:
+        """Presigned POST form letting a client upload one file straight to MinIO
+
+        The policy pins the object key, content type and filename, and bounds the size.
+        Call complete_upload once the client is done.
+        """
+        if self.allowed_extensions is not None and not is_allowed_file(
+            filename, content_type, self.allowed_extensions
+        ):
+            raise exceptions.BadRequest(
+                "File extension should be one of: " + ", ".join(self.allowed_extensions)
+            )
+
+        if max_size is None:
+            max_size = settings.minio_max_upload_size_mb * 1024 * 1024
+        if expires is None:
+            expires = timedelta(seconds=settings.minio_presign_expiry_seconds)
+
+        object_name = str(uuid.uuid4())
+        key = f"{self.file_prefix}/{object_name}"
+        fields = {
+            "key": key,
+            "Content-Type": content_type,
+            "x-amz-meta-filename": filename,
+        }
+
+        policy = PostPolicy(self.bucket_name, datetime.now(timezone.utc) + expires)
+        for element, value in fields.items():
+            policy.add_equals_condition(element, value)
+        policy.add_content_length_range_condition(1, max_size)
+
+        with track_dependency("minio", "presigned_post_policy"):
+            form_data = await self.presign_client.presigned_post_policy(policy)
+        scheme = "https" if self.public_secure else "http"
+        return {
+            "object_name": object_name,
+            "url": f"{scheme}://{self.public_endpoint}/{self.bucket_name}",
+            "fields": {**fields, **form_data},
+            "expires_in": int(expires.total_seconds()),
+        }
+
+    async def presign_download(
+        self, object_name: str, expires: timedelta | None = None
+    ) -> str:
+        """Short-lived presigned GET URL of an object"""
+        if expires is None:
+            expires = timedelta(seconds=settings.minio_presign_expiry_seconds)
+
+        info = await self.stat(object_name)
+        return await self.presign_client.presigned_get_object(
+            bucket_name=self.bucket_name,
+            object_name=info.key,
+            expires=expires,
+            response_headers={
+                "response-content-disposition": f"inline; filename*=UTF-8''{quote(info.filename)}"
+            },
+        )
+
+    async def complete_upload(self, object_name: str) -> ObjectInfo:
+        """Validate an object uploaded through a presigned form, removing it if invalid"""
+        info = await self.stat(object_name)
+
+        if self.allowed_extensions is not None and not is_allowed_file(
+            info.filename, info.content_type, self.allowed_extensions
+        ):
+            await self.delete(object_name)
+            raise exceptions.BadRequest(
+                f"Invalid file {info.filename} with content type {info.content_type}"
+            )
+
+        return info
+
+    async def delete(self, object_name: str) -> None:
+        if self.content_addressed:
+            stored = await StoredFile.get_pymongo_collection().find_one_and_delete(
+                {"bucket_name": self.bucket_name, "file_prefix": self.file_prefix, "object_name": object_name}
+            )
+            if stored is not None:
+                await self._release_blob(stored["digest"])
+                return
+
+        object_disk_cache.invalidate(f"{self.bucket_name}/{self.file_prefix}/{object_name}")
+        with track_dependency("minio", "remove_object"):
+            await self.client.remove_object(
+                bucket_name=self.bucket_name,
+                object_name=f"{self.file_prefix}/{object_name}",
+            )
+
+    async def put_many(
+        self, files: list[UploadFile], max_concurrency: int | None = None
+    ) -> list[dict]:
+        """Upload several files concurrently, one result per file in the same order"""
+        semaphore = asyncio.Semaphore(max_concurrency or settings.minio_batch_concurrency)
+
+        async def put_one(file: UploadFile) -> dict:
+            filename = file.filename
+            async with semaphore:
+                try:
+                    object_name = await self.put(file)
+                except exceptions.BaseAPIException as e:
+                    return {"filename": filename, "object_name": None, "status_code": e.status_code, "error": e.detail}
+                except S3Error as e:
+                    print(f"Error uploading {filename} to {self.bucket_name}: {e}")
+                    return {"filename": filename, "object_name": None, "status_code": 502, "error": e.code}
+                except Exception as e:
+                    # Any other failure only fails this file, e.g. a network or Mongo error
+                    print(f"Error uploading {filename} to {self.bucket_name}: {e}")
+                    return {"filename": filename, "object_name": None, "status_code": 500, "error": str(e)}
+            return {"filename": filename, "object_name": object_name, "status_code": 201, "error": None}
+
+        return list(await asyncio.gather(*(put_one(file) for file in files)))
+
+    async def delete_many(self, object_names: list[str]) -> dict[str, str]:
+        """Delete several objects, returns the errors by object name"""
+        if self.content_addressed:
+            # Reference counts are kept per object
+            return await self._delete_each(object_names)
+        return await self._remove_objects(object_names)
+
+    async def _delete_each(self, object_names: list[str]) -> dict[str, str]:
+        semaphore = asyncio.Semaphore(settings.minio_batch_concurrency)
+        errors: dict[str, str] = {}
+
+        async def delete_one(object_name: str) -> None:
+            async with semaphore:
+                try:
+                    await self.delete(object_name)
+                except S3Error as e:
+                    errors[object_name] = e.message or e.code
+                except Exception as e:
+                    errors[object_name] = str(e)
+
+        await asyncio.gather(*(delete_one(object_name) for object_name in object_names))
+        return errors
+
+    async def _remove_objects(self, object_names: list[str]) -> dict[str, str]:
+        # One multi-object delete request per 1000 keys
+        keys = {f"{self.file_prefix}/{object_name}": object_name for object_name in object_names}
+        for key in keys:
+            object_disk_cache.invalidate(f"{self.bucket_name}/{key}")
+
+        errors: dict[str, str] = {}
+        with track_dependency("minio", "remove_objects"):
+            async for error in self.client.remove_objects(
+                self.bucket_name, [DeleteObject(key) for key in keys]
+            ):
+                errors[keys.get(error.name, error.name)] = error.message or error.code
+        return errors
+
+image_ext_content_type_map = {
+    "apng": ["image/apng"],
+    "avif": ["image/avif"],
+    "gif": ["image/gif"],
+    "jpeg": ["image/jpeg"],
+    "jpg": ["image/jpeg"],
+    "png": ["image/png", "image/x-citrix-png"],
+    "svg": ["image/svg+xml"],
+    "webp": ["image/webp"],
+    "ico": ["image/x-icon", "image/vnd.microsoft.icon"],
+}
+
+class ImageBucket(Bucket):
+    allowed_extensions = image_ext_content_type_map
+    content_addressed = settings.minio_content_addressed
+    # Variant renders in progress, shared by concurrent first requests
+    _rendering: dict[str, asyncio.Future] = {}
+    # Keeps eager render tasks referenced until they finish, each holds its image in memory
+    _background_tasks: set[asyncio.Task] = set()
+    # Eager renders running at once, the others wait their turn
+    _render_slots = asyncio.Semaphore(settings.image_variant_workers)
+
+    def __init__(self, file_prefix: str):
+        super().__init__(IMAGES_BUCKET_NAME, file_prefix)
+
+    async def put(self, file: UploadFile, object_name: str | None = None) -> str:
+        check_extension(file, image_ext_content_type_map)
+        replacing = object_name is not None
+        object_name = await super().put(file, object_name)
+
+        if replacing:
+            await self.delete_variants(object_name)
+
+        if settings.image_variants_eager and file.content_type in RASTER_CONTENT_TYPES:
+            if len(self._background_tasks) >= settings.image_variant_max_pending:
+                # Backlogged, the variants are rendered when first requested instead
+                print(f"Variant render backlog full, deferring variants of image {object_name}")
+                return object_name
+
+            # UploadFile reads spooled files in a thread, off the event loop
+            await file.seek(0)
+            data = await file.read()
+            task = asyncio.create_task(
+                self.render_variants(data, object_name, file.filename or object_name)
+            )
+            self._background_tasks.add(task)
+            task.add_done_callback(self._render_done)
+
+        return object_name
+
+    async def delete(self, object_name: str) -> None:
+        await super().delete(object_name)
+        await self.delete_variants(object_name)
+
+    async def delete_many(self, object_names: list[str]) -> dict[str, str]:
+        if self.content_addressed:
+            return await super().delete_many(object_names)
+
+        # Originals and their variants go in the same batch
+        variant_names = [
+            variant_object_name(object_name, variant)
+            for object_name in object_names
+            for variant in VARIANTS
+        ]
+        errors = await self._remove_objects([*object_names, *variant_names])
+        return {name: error for name, error in errors.items() if name in object_names}
+
+    async def delete_variants(self, object_name: str) -> None:
+        for variant in VARIANTS:
+            await super().delete(variant_object_name(object_name, variant))
+
+    @classmethod
+    def _render_done(cls, task: asyncio.Task) -> None:
+        cls._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Variant render task failed: {task.exception()!r}")
+
+    async def render_variants(self, data: bytes, object_name: str, filename: str) -> None:
+        """Render and store every variant of an image, one render slot per image"""
+        try:
+            async with self._render_slots:
+                await asyncio.gather(
+                    *(
+                        self._store_variant(data, object_name, variant, filename)
+                        for variant in VARIANTS
+                    )
+                )
+        except Exception as e:
+            print(f"Error rendering variants of image {object_name}: {e}")
+
+    async def _store_variant(
+        self, data: bytes, object_name: str, variant: str, filename: str
+    ) -> None:
+        rendered, content_type = await image_variant_renderer.render(data, variant)
+        await self.put_bytes(
+            rendered,
+            variant_object_name(object_name, variant),
+            content_type,
+            f"{variant}-{filename}",
+        )
+
+    async def _render_missing_variant(self, object_name: str, variant: str) -> None:
+        key = f"{self.file_prefix}/{variant_object_name(object_name, variant)}"
+        rendering = self._rendering.get(key)
+        if rendering is not None:
+            await asyncio.shield(rendering)
+            return
+
+        rendering = asyncio.get_running_loop().create_future()
+        self._rendering[key] = rendering
+        try:
+            data, filename, content_type = await self.get(object_name)
+            if content_type not in RASTER_CONTENT_TYPES:
+                raise exceptions.BadRequest(f"No variants for {content_type} images")
+            await self._store_variant(data, object_name, variant, filename)
+            rendering.set_result(None)
+        except BaseException as e:
+            rendering.set_exception(
+                e if isinstance(e, Exception) else RuntimeError("Rendering cancelled")
+            )
+            rendering.exception()  # Mark as retrieved when nobody was waiting
+            raise
+        finally:
+            self._rendering.pop(key, None)
+
+    async def variant_response(
+        self, object_name: str, variant: str, if_none_match: Optional[str] = None
+    ) -> Response:
+        """Serve a variant, rendering it on first request"""
+        if variant not in VARIANTS:
+            raise exceptions.NotFound(f"Unknown image variant: {variant}")
+
+        name = variant_object_name(object_name, variant)
+        try:
+            return await self.streaming_response(
+                name, if_none_match=if_none_match, cache_control=VARIANT_CACHE_CONTROL
+            )
+        except exceptions.NotFound:
+            await self._render_missing_variant(object_name, variant)
+
+        return await self.streaming_response(
+            name, if_none_match=if_none_match, cache_control=VARIANT_CACHE_CONTROL
+        )
+
+class DocumentBucket(Bucket):
+    content_addressed = settings.minio_content_addressed
+
+    def __init__(self, file_prefix: str):
+        super().__init__(DOCUMENTS_BUCKET_NAME, file_prefix)
+
+class WaSimBucket(Bucket):
+    def __init__(self):
+        super().__init__(WA_SIM_BUCKET_NAME, "")
+
+    async def put(self, file: UploadFile, object_name: str | None = None) -> str:
+        if object_name is None:
+            object_name = "".join(random.choice(string.digits) for _ in range(16))
+        return await super().put(file, object_name)
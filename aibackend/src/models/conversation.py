@@ -1,4 +1,5 @@
-from beanie import Document
+from beanie import Document, PydanticObjectId
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from pydantic import BaseModel, Field
 from typing import Optional, List
 from datetime import datetime
@@ -39,7 +40,8 @@ class Message(Document):
         indexes = [
             "conversation_id",
             "role",
-            "created_at"
+            "created_at",
+            IndexModel([("conversation_id", ASCENDING), ("created_at", DESCENDING)])
         ]
 
 
@@ -56,7 +58,7 @@ class Conversation(Document):
     restaurant_id: Optional[str] = Field(None, description="Restaurant ID if restaurant-specific")
     
     # AI Configuration
-    ai_model: str = Field(default="gpt-3.5-turbo", description="AI model to use for this conversation")
+    ai_model: Optional[str] = Field(None, description="AI model to use for this conversation, None follows the routing policy")
     system_prompt: Optional[str] = Field(None, description="System prompt for the AI")
     max_tokens: Optional[int] = Field(None, description="Maximum tokens per response")
     temperature: Optional[float] = Field(None, description="AI response temperature")
@@ -70,6 +72,9 @@ class Conversation(Document):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     last_activity: datetime = Field(default_factory=datetime.utcnow)
     
+    # IDs are client strings or ObjectIds, pagination breaks ties on this instead
+    sort_id: PydanticObjectId = Field(default_factory=PydanticObjectId, description="Always an ObjectId, keyset pagination tiebreak")
+    
     # Metadata
     tags: List[str] = Field(default_factory=list, description="Tags for categorizing conversations")
     metadata: Optional[dict] = Field(default_factory=dict, description="Additional conversation metadata")
@@ -82,7 +87,11 @@ class Conversation(Document):
             "restaurant_id",
             "status",
             "created_at",
-            "last_activity"
+            "last_activity",
+            # Keyset pagination, newest first
+            IndexModel([("created_at", DESCENDING), ("sort_id", DESCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("sort_id", DESCENDING)]),
+            IndexModel([("restaurant_id", ASCENDING), ("created_at", DESCENDING), ("sort_id", DESCENDING)])
         ]
 
 
@@ -92,7 +101,7 @@ class ConversationCreate(BaseModel):
     user_id: Optional[str] = None
     session_id: Optional[str] = None
     restaurant_id: Optional[str] = None
-    ai_model: str = "gpt-3.5-turbo"
+    ai_model: Optional[str] = None
     system_prompt: Optional[str] = None
     max_tokens: Optional[int] = None
     temperature: Optional[float] = None
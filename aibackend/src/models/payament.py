@@ -1,4 +1,5 @@
 from beanie import Document
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 from datetime import datetime
@@ -14,6 +15,16 @@ class PaymentStatus(str, Enum):
     REFUNDED = "refunded"
 
 
+class CheckoutLinkStatus(str, Enum):
+    PENDING = "pending"
+    CREATING = "creating"
+    READY = "ready"
+    FAILED = "failed"
+
+
+NON_TERMINAL_STATUSES = [PaymentStatus.PENDING, PaymentStatus.PROCESSING]
+
+
 class PaymentMethod(str, Enum):
     CARD = "card"
     CASH = "cash"
@@ -49,6 +60,10 @@ class Payment(Document):
     chargily_status: Optional[ChargilyStatus] = Field(None, description="Chargily payment status")
     chargily_payment_url: Optional[str] = Field(None, description="Chargily payment URL")
     chargily_webhook_data: Optional[Dict[str, Any]] = Field(None, description="Chargily webhook data")
+    checkout_link_status: Optional[CheckoutLinkStatus] = Field(None, description="Status of the background Chargily checkout link creation")
+    checkout_link_error: Optional[str] = Field(None, description="Why the checkout link could not be created")
+    checkout_link_owner: Optional[str] = Field(None, description="Worker process creating the checkout link")
+    checkout_link_claimed_at: Optional[datetime] = Field(None, description="When the checkout link creation was claimed")
     
     # Transaction details
     transaction_id: Optional[str] = Field(None, description="Internal transaction ID")
@@ -64,6 +79,8 @@ class Payment(Document):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     completed_at: Optional[datetime] = Field(None, description="When payment was completed")
     expires_at: Optional[datetime] = Field(None, description="When payment expires")
+    last_synced_at: Optional[datetime] = Field(None, description="When the status was last checked with Chargily")
+    last_sync_attempt_at: Optional[datetime] = Field(None, description="When a Chargily check was last attempted, failed ones included")
     
     class Settings:
         name = "payments"
@@ -74,7 +91,13 @@ class Payment(Document):
             "status",
             "method",
             "chargily_payment_id",
-            "created_at"
+            "created_at",
+            IndexModel([("method", ASCENDING), ("status", ASCENDING), ("last_sync_attempt_at", ASCENDING)]),
+            # Keyset pagination, newest first
+            IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("restaurant_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("restaurant_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
         ]
 
 
@@ -104,6 +127,42 @@ class PaymentUpdate(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 
+class WebhookEventStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    PROCESSED = "processed"
+    FAILED = "failed"
+
+
+class ChargilyWebhookEvent(Document):
+    """Inbox entry for a received Chargily webhook"""
+    
+    dedup_key: str = Field(..., description="invoice_id:status, identical deliveries share it")
+    invoice_id: str = Field(..., description="Chargily invoice ID")
+    chargily_status: str = Field(..., description="Chargily status reported by the webhook")
+    payload: Dict[str, Any] = Field(..., description="Parsed webhook data")
+    
+    # Processing state
+    status: WebhookEventStatus = Field(default=WebhookEventStatus.PENDING, description="Inbox processing status")
+    attempts: int = Field(default=0, description="Number of processing attempts")
+    last_error: Optional[str] = Field(None, description="Error of the last failed attempt")
+    lease_id: Optional[str] = Field(None, description="Worker batch currently processing the event")
+    next_attempt_at: Optional[datetime] = Field(None, description="Earliest time a failed event is retried")
+    
+    # Timestamps
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+    claimed_at: Optional[datetime] = Field(None, description="When a worker claimed the event")
+    processed_at: Optional[datetime] = Field(None, description="When the event was applied")
+    
+    class Settings:
+        name = "chargily_webhook_events"
+        indexes = [
+            IndexModel([("dedup_key", ASCENDING)], unique=True),
+            IndexModel([("status", ASCENDING), ("received_at", ASCENDING)]),
+            "lease_id"
+        ]
+
+
 class ChargilyWebhookData(BaseModel):
     """Schema for Chargily webhook data"""
     invoice_id: str
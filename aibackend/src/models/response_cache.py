@@ -0,0 +1,26 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from typing import Optional
+from datetime import datetime
+
+
+class CachedResponse(Document):
+    """Persisted LLM answer shared across processes"""
+    
+    key: str = Field(..., description="Hash of the normalized prompt, handler, model, restaurant and sampling settings")
+    handler: str = Field(..., description="Agent handler that produced the response")
+    model: str = Field(..., description="AI model that produced the response")
+    restaurant_id: Optional[str] = Field(None, description="Restaurant the response was generated for")
+    response: str = Field(..., description="Cached response content")
+    
+    # Timestamps
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(..., description="When MongoDB removes this entry")
+    
+    class Settings:
+        name = "llm_response_cache"
+        indexes = [
+            IndexModel([("key", ASCENDING)], unique=True),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        ]
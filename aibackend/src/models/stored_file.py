@@ -0,0 +1,54 @@
+from beanie import Document
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime
+from typing import Optional
+
+
+class StoredBlob(Document):
+    """Content-addressed object shared by every file with the same bytes"""
+    
+    bucket_name: str = Field(..., description="MinIO bucket holding the blob")
+    digest: str = Field(..., description="SHA-256 of the content")
+    size: int = Field(..., description="Size in bytes")
+    content_type: str = Field(..., description="Content type of the first upload")
+    ref_count: int = Field(0, description="Number of stored files pointing at this blob")
+    object_key: Optional[str] = Field(None, description="Object holding the content, blobs/<digest> when unset")
+    deleting: bool = Field(False, description="Tombstone of a blob whose object is being removed")
+    removal_token: Optional[str] = Field(None, description="Owner of the removal, unset when a claim takes the tombstone over")
+    
+    # Timestamps
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    class Settings:
+        name = "stored_blobs"
+        indexes = [
+            IndexModel([("bucket_name", ASCENDING), ("digest", ASCENDING)], unique=True)
+        ]
+
+
+class StoredFile(Document):
+    """Logical file name mapped to the blob holding its content"""
+    
+    bucket_name: str = Field(..., description="MinIO bucket")
+    file_prefix: str = Field(..., description="Prefix the file was stored under")
+    object_name: str = Field(..., description="Name returned to the uploader")
+    digest: str = Field(..., description="SHA-256 of the content")
+    blob_key: Optional[str] = Field(None, description="Object of the blob, blobs/<digest> when unset")
+    filename: str = Field(..., description="Original filename")
+    content_type: str = Field(..., description="Content type of the upload")
+    size: int = Field(..., description="Size in bytes")
+    
+    # Timestamps
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    
+    class Settings:
+        name = "stored_files"
+        indexes = [
+            IndexModel(
+                [("bucket_name", ASCENDING), ("file_prefix", ASCENDING), ("object_name", ASCENDING)],
+                unique=True
+            )
+        ]
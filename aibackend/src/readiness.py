@@ -0,0 +1,62 @@
+import asyncio
+from typing import Optional
+
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# Served while the app is still warming up
+EXEMPT_PATHS = {"/health", "/health/live", "/health/ready", "/metrics", "/docs", "/redoc", "/openapi.json"}
+
+
+class ReadinessGate:
+    """Closed until the lifespan warm-up is done, requests get a 503 meanwhile"""
+    
+    def __init__(self):
+        self._ready = asyncio.Event()
+        self.error: Optional[str] = None
+        self.failed = False
+    
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+    
+    def open(self) -> None:
+        self.error = None
+        self.failed = False
+        self._ready.set()
+    
+    def fail(self, error: Exception) -> None:
+        """Record why warm-up gave up, the gate stays closed and liveness fails"""
+        self.error = f"{type(error).__name__}: {error}"
+        self.failed = True
+    
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class ReadinessMiddleware:
+    """Answer 503 until the readiness gate opens"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or readiness_gate.is_ready or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        
+        response = JSONResponse(
+            status_code=503,
+            content={"detail": "Service is starting", "error": readiness_gate.error},
+            headers={"Retry-After": "1"},
+        )
+        await response(scope, receive, send)
+
+
+# Global instance
+readiness_gate = ReadinessGate()
@@ -1,11 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
+from pymongo import DESCENDING
 
 from src.models.conversation import Conversation, Message, ConversationCreate, MessageCreate
-from src.services.ai_agent_service import ai_agent_service
+from src.services.ai_agent_service import get_ai_agent_service
+from src.services.response_cache import response_cache
+from src.services.health_service import health_service
+from src.services.llm_scheduler import llm_scheduler
+from src.services.llm_registry import llm_registry
 from src.exception import exceptions
+from src.config import settings
+from src.utils import ClientDisconnected, format_sse, encode_cursor, keyset_filter, run_until_disconnected
 
 router = APIRouter(prefix="/ai", tags=["ai-agent"])
 
@@ -47,41 +55,86 @@ class MessageResponse(BaseModel):
     created_at: datetime
     model_used: Optional[str]
     processing_time: Optional[float]
+    metadata: Optional[dict] = None
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest) -> ChatResponse:
-    """Chat with the AI agent"""
+async def chat_with_agent(request: ChatRequest, http_request: Request) -> ChatResponse:
+    """Chat with the AI agent
+    
+    The agent run is cancelled if the client disconnects before the answer is ready,
+    which also aborts the pending OpenAI request.
+    """
     
     try:
         # Generate conversation ID if not provided
         conversation_id = request.conversation_id or f"conv_{datetime.utcnow().timestamp()}"
         
         # Process message with AI agent
-        response = await ai_agent_service.process_message(
-            conversation_id=conversation_id,
-            message_content=request.message,
-            user_id=request.user_id,
-            restaurant_id=request.restaurant_id
-        )
-        
-        # Get the latest message from the conversation
-        latest_message = await Message.find_one(
-            {"conversation_id": conversation_id},
-            sort=[("created_at", -1)]
+        reply = await run_until_disconnected(
+            http_request,
+            get_ai_agent_service().process_message(
+                conversation_id=conversation_id,
+                message_content=request.message,
+                user_id=request.user_id,
+                restaurant_id=request.restaurant_id
+            ),
+            poll_interval=settings.ai_disconnect_poll_seconds
         )
         
         return ChatResponse(
-            response=response,
-            conversation_id=conversation_id,
-            message_id=str(latest_message.id) if latest_message else "",
+            response=reply.response,
+            conversation_id=reply.conversation_id,
+            message_id=reply.message_id,
             timestamp=datetime.utcnow()
         )
         
+    except ClientDisconnected:
+        # Nobody reads this, 499 is the nginx convention for a closed client connection
+        return Response(status_code=499)
+    except exceptions.TooManyRequests as e:
+        raise HTTPException(status_code=429, detail=e.detail, headers=e.headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}")
 
 
+@router.post("/chat/stream")
+async def chat_with_agent_stream(request: ChatRequest) -> StreamingResponse:
+    """Chat with the AI agent, streaming the response as Server-Sent Events"""
+    
+    # Generate conversation ID if not provided
+    conversation_id = request.conversation_id or f"conv_{datetime.utcnow().timestamp()}"
+    
+    # Reject before opening the stream when the LLM queue is full
+    try:
+        await get_ai_agent_service().check_capacity(conversation_id, request.message)
+    except exceptions.TooManyRequests as e:
+        raise HTTPException(status_code=429, detail=e.detail, headers=e.headers)
+    
+    async def event_source():
+        try:
+            async for event in get_ai_agent_service().stream_message(
+                conversation_id=conversation_id,
+                message_content=request.message,
+                user_id=request.user_id,
+                restaurant_id=request.restaurant_id
+            ):
+                yield format_sse(event["event"], event["data"])
+        except exceptions.TooManyRequests as e:
+            yield format_sse("error", {"detail": e.detail, "status_code": 429})
+        except Exception as e:
+            yield format_sse("error", {"detail": f"Failed to process message: {str(e)}"})
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 @router.post("/conversations", response_model=ConversationResponse)
 async def create_conversation(conversation_data: ConversationCreate) -> ConversationResponse:
     """Create a new conversation"""
@@ -138,20 +191,38 @@ async def get_conversation(conversation_id: str) -> ConversationResponse:
 
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def list_conversations(
+    response: Response,
     user_id: Optional[str] = None,
     restaurant_id: Optional[str] = None,
-    limit: int = 50,
-    offset: int = 0
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None
 ) -> List[ConversationResponse]:
-    """List conversations with optional filters"""
+    """List conversations with optional filters, newest first
+    
+    Pass the X-Next-Cursor header of a page as cursor to get the next one.
+    """
     
     query = {}
     if user_id:
         query["user_id"] = user_id
     if restaurant_id:
         query["restaurant_id"] = restaurant_id
+    if cursor:
+        try:
+            query.update(keyset_filter(cursor, id_field="sort_id"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    conversations = await Conversation.find(query).skip(offset).limit(limit).to_list()
+    find_query = Conversation.find(query).sort([("created_at", DESCENDING), ("sort_id", DESCENDING)])
+    if offset and not cursor:
+        find_query = find_query.skip(offset)
+    conversations = await find_query.limit(limit + 1).to_list()
+    
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        if conversations:
+            response.headers["X-Next-Cursor"] = encode_cursor(conversations[-1].created_at, conversations[-1].sort_id)
     
     return [
         ConversationResponse(
@@ -193,7 +264,8 @@ async def get_conversation_messages(
             content=msg.content,
             created_at=msg.created_at,
             model_used=msg.model_used,
-            processing_time=msg.processing_time
+            processing_time=msg.processing_time,
+            metadata=msg.metadata
         )
         for msg in messages
     ]
@@ -233,7 +305,8 @@ async def add_message_to_conversation(
             content=message.content,
             created_at=message.created_at,
             model_used=message.model_used,
-            processing_time=message.processing_time
+            processing_time=message.processing_time,
+            metadata=message.metadata
         )
         
     except Exception as e:
@@ -296,30 +369,41 @@ async def delete_conversation(conversation_id: str) -> dict:
         raise HTTPException(status_code=500, detail=f"Failed to delete conversation: {str(e)}")
 
 
+@router.get("/cache/stats")
+async def get_cache_stats() -> dict:
+    """Hit/miss counters of the LLM response cache"""
+    return response_cache.get_stats()
+
+
+@router.get("/scheduler/stats")
+async def get_scheduler_stats() -> dict:
+    """Concurrency, token budget and queue stats of the LLM scheduler, per model"""
+    return llm_scheduler.get_stats()
+
+
+@router.get("/models")
+async def get_model_routing() -> dict:
+    """Model routing policy and the LLM clients built so far"""
+    return llm_registry.get_stats()
+
+
 @router.get("/health")
 async def health_check() -> dict:
-    """Health check for AI agent service"""
+    """Health check for AI agent service
     
-    try:
-        # Test basic functionality
-        test_response = await ai_agent_service.process_message(
-            conversation_id="health_check",
-            message_content="Hello",
-            user_id="system",
-            restaurant_id="system"
-        )
-        
-        return {
-            "status": "healthy",
-            "service": "ai-agent",
-            "timestamp": datetime.utcnow(),
-            "test_response_length": len(test_response)
-        }
-        
-    except Exception as e:
-        return {
-            "status": "unhealthy",
-            "service": "ai-agent",
-            "timestamp": datetime.utcnow(),
-            "error": str(e)
-        }
+    Reports the cached OpenAI and Mongo checks and the last background deep check,
+    it never runs a chat turn itself.
+    """
+    
+    results = await health_service.check_all(["openai", "mongo"])
+    healthy = all(result.healthy for result in results.values())
+    
+    report = {
+        "status": "healthy" if healthy else "unhealthy",
+        "service": "ai-agent",
+        "timestamp": datetime.utcnow(),
+        "checks": {name: result.to_dict() for name, result in results.items()}
+    }
+    if health_service.deep_result is not None:
+        report["deep_check"] = health_service.deep_result.to_dict()
+    return report
@@ -0,0 +1,159 @@
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+from fastapi.responses import Response
+from pydantic import BaseModel
+from typing import List, Optional
+
+from src.minio import Bucket, DocumentBucket, ImageBucket
+from src.exception import exceptions
+from src.config import settings
+from src.services.object_cache import object_disk_cache
+
+router = APIRouter(prefix="/files", tags=["files"])
+
+
+BUCKETS = {
+    "images": ImageBucket,
+    "documents": DocumentBucket,
+}
+
+
+def get_bucket(bucket: str, file_prefix: str) -> Bucket:
+    """Resolve a bucket from its public name"""
+    
+    bucket_class = BUCKETS.get(bucket)
+    if bucket_class is None:
+        raise HTTPException(status_code=404, detail="Bucket not found")
+    return bucket_class(file_prefix)
+
+
+class PresignUploadRequest(BaseModel):
+    """Request model for a presigned upload"""
+    filename: str
+    content_type: str
+    size: Optional[int] = None
+
+
+class BatchDeleteRequest(BaseModel):
+    """Request model for deleting several files"""
+    object_names: List[str]
+
+
+@router.post("/{bucket}/{file_prefix}/batch-upload")
+async def batch_upload(bucket: str, file_prefix: str, files: List[UploadFile] = File(...)) -> dict:
+    """Upload several files at once
+    
+    Files are stored concurrently with bounded parallelism. A file that fails
+    doesn't fail the batch, check the per-file results.
+    """
+    
+    if len(files) > settings.minio_batch_max_files:
+        raise HTTPException(status_code=413, detail=f"At most {settings.minio_batch_max_files} files per batch")
+    
+    results = await get_bucket(bucket, file_prefix).put_many(files)
+    uploaded = sum(1 for result in results if result["error"] is None)
+    return {
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded,
+        "results": results,
+    }
+
+
+@router.post("/{bucket}/{file_prefix}/batch-delete")
+async def batch_delete(bucket: str, file_prefix: str, delete_request: BatchDeleteRequest) -> dict:
+    """Delete several files with multi-object delete requests"""
+    
+    if len(delete_request.object_names) > settings.minio_batch_max_files:
+        raise HTTPException(status_code=413, detail=f"At most {settings.minio_batch_max_files} files per batch")
+    
+    object_names = list(dict.fromkeys(delete_request.object_names))
+    errors = await get_bucket(bucket, file_prefix).delete_many(object_names)
+    return {
+        "deleted": [object_name for object_name in object_names if object_name not in errors],
+        "errors": errors,
+    }
+
+
+@router.post("/{bucket}/{file_prefix}/presign-upload")
+async def presign_upload(bucket: str, file_prefix: str, upload_request: PresignUploadRequest) -> dict:
+    """Get a presigned form to upload a file directly to storage"""
+    
+    max_size = settings.minio_max_upload_size_mb * 1024 * 1024
+    if upload_request.size is not None and upload_request.size > max_size:
+        raise HTTPException(status_code=413, detail=f"File is larger than {settings.minio_max_upload_size_mb} MB")
+    
+    try:
+        return await get_bucket(bucket, file_prefix).presign_upload(
+            filename=upload_request.filename,
+            content_type=upload_request.content_type,
+            max_size=upload_request.size or max_size,
+        )
+    except exceptions.BadRequest as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+
+
+@router.post("/{bucket}/{file_prefix}/{object_name}/complete")
+async def complete_upload(bucket: str, file_prefix: str, object_name: str) -> dict:
+    """Validate a file uploaded with a presigned form"""
+    
+    try:
+        info = await get_bucket(bucket, file_prefix).complete_upload(object_name)
+    except exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+    except exceptions.BadRequest as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+    
+    return {
+        "object_name": object_name,
+        "filename": info.filename,
+        "content_type": info.content_type,
+        "size": info.size,
+        "etag": info.etag,
+    }
+
+
+@router.get("/{bucket}/{file_prefix}/{object_name}/presign-download")
+async def presign_download(bucket: str, file_prefix: str, object_name: str) -> dict:
+    """Get a short-lived URL to download a file directly from storage"""
+    
+    try:
+        url = await get_bucket(bucket, file_prefix).presign_download(object_name)
+    except exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    return {"url": url, "expires_in": settings.minio_presign_expiry_seconds}
+
+
+@router.get("/cache/stats")
+async def get_object_cache_stats() -> dict:
+    """Local disk object cache counters"""
+    return object_disk_cache.get_stats()
+
+
+@router.get("/images/{file_prefix}/{object_name}/variants/{variant}")
+async def download_image_variant(file_prefix: str, object_name: str, variant: str, request: Request) -> Response:
+    """Serve a resized rendition (thumbnail, medium, webp) of an image"""
+    
+    try:
+        return await ImageBucket(file_prefix).variant_response(
+            object_name,
+            variant,
+            if_none_match=request.headers.get("If-None-Match"),
+        )
+    except exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except exceptions.BadRequest as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+
+
+@router.get("/{bucket}/{file_prefix}/{object_name}")
+async def download_file(bucket: str, file_prefix: str, object_name: str, request: Request) -> Response:
+    """Stream a stored file, supports Range and If-None-Match requests"""
+    
+    try:
+        return await get_bucket(bucket, file_prefix).streaming_response(
+            object_name,
+            range_header=request.headers.get("Range"),
+            if_none_match=request.headers.get("If-None-Match"),
+        )
+    except exceptions.NotFound:
+        raise HTTPException(status_code=404, detail="File not found")
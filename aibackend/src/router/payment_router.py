@@ -1,30 +1,50 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse
+from beanie import PydanticObjectId
+from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
+import json
 import uuid
+from pymongo import DESCENDING
 
 from src.models.payament import (
     Payment, 
     PaymentCreate, 
     PaymentUpdate, 
-    ChargilyPaymentRequest,
-    ChargilyWebhookData,
+    ChargilyWebhookEvent,
     PaymentStatus,
-    ChargilyStatus
+    ChargilyStatus,
+    CheckoutLinkStatus,
+    WebhookEventStatus,
+    NON_TERMINAL_STATUSES
 )
-from src.services.chargily_service import chargily_service
+from src.services.chargily_service import get_chargily_service
+from src.services.payment_reconciler import payment_reconciler
+from src.services.webhook_inbox import webhook_inbox
+from src.services.checkout_link_worker import IN_PROGRESS_STATUSES, checkout_link_worker
+from src.config import settings
 from src.exception import exceptions
+from src.utils import encode_cursor, keyset_filter
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
 
 @router.post("/", response_model=Payment)
-async def create_payment(payment_data: PaymentCreate) -> Payment:
-    """Create a new payment"""
+async def create_payment(payment_data: PaymentCreate, async_checkout: Optional[bool] = None) -> Payment:
+    """Create a new payment
+    
+    With async_checkout the payment is stored right away as pending and the Chargily
+    checkout link is created in the background, fetch it from /{payment_id}/chargily-url.
+    """
+    
+    if async_checkout is None:
+        async_checkout = settings.chargily_async_checkout
     
     try:
         # Create payment record
         payment = Payment(
+            id=PydanticObjectId(),
             amount=payment_data.amount,
             currency=payment_data.currency,
             method=payment_data.method,
@@ -40,29 +60,22 @@ async def create_payment(payment_data: PaymentCreate) -> Payment:
         
         # If Chargily payment, create payment with Chargily
         if payment_data.method == "chargily":
-            chargily_request = ChargilyPaymentRequest(
-                amount=payment_data.amount,
-                currency=payment_data.currency,
-                success_url=f"https://your-frontend.com/payment/success?payment_id={payment.id}",
-                failure_url=f"https://your-frontend.com/payment/failure?payment_id={payment.id}",
-                webhook_url=f"https://your-backend.com/api/payments/webhook",
-                invoice_number=f"INV-{payment.transaction_id}",
-                metadata={
-                    "payment_id": str(payment.id),
-                    "user_id": payment_data.user_id,
-                    "restaurant_id": payment_data.restaurant_id,
-                    "table_id": payment_data.table_id
-                }
-            )
+            if async_checkout:
+                payment.checkout_link_status = CheckoutLinkStatus.PENDING
+                await payment.insert()
+                checkout_link_worker.submit(payment.id)
+                return payment
             
+            chargily_service = get_chargily_service()
             chargily_response = await chargily_service.create_payment(
-                chargily_request, 
+                chargily_service.build_payment_request(payment),
                 str(payment.id)
             )
             
             payment.chargily_payment_id = chargily_response.invoice_id
             payment.chargily_payment_url = chargily_response.checkout_url
             payment.chargily_status = ChargilyStatus.PENDING
+            payment.checkout_link_status = CheckoutLinkStatus.READY
             payment.status = PaymentStatus.PROCESSING
             payment.expires_at = datetime.utcnow() + timedelta(hours=24)
         
@@ -73,6 +86,12 @@ async def create_payment(payment_data: PaymentCreate) -> Payment:
         raise HTTPException(status_code=500, detail=f"Failed to create payment: {str(e)}")
 
 
+@router.get("/chargily/pool")
+async def get_chargily_pool_stats() -> dict:
+    """Connection pool statistics of the Chargily HTTP client"""
+    return get_chargily_service().pool_stats()
+
+
 @router.get("/{payment_id}", response_model=Payment)
 async def get_payment(payment_id: str) -> Payment:
     """Get payment by ID"""
@@ -86,13 +105,18 @@ async def get_payment(payment_id: str) -> Payment:
 
 @router.get("/", response_model=List[Payment])
 async def list_payments(
+    response: Response,
     user_id: Optional[str] = None,
     restaurant_id: Optional[str] = None,
     status: Optional[PaymentStatus] = None,
-    limit: int = 50,
-    offset: int = 0
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None
 ) -> List[Payment]:
-    """List payments with optional filters"""
+    """List payments with optional filters, newest first
+    
+    Pass the X-Next-Cursor header of a page as cursor to get the next one.
+    """
     
     query = {}
     if user_id:
@@ -101,8 +125,22 @@ async def list_payments(
         query["restaurant_id"] = restaurant_id
     if status:
         query["status"] = status
+    if cursor:
+        try:
+            query.update(keyset_filter(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    find_query = Payment.find(query).sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+    if offset and not cursor:
+        find_query = find_query.skip(offset)
+    payments = await find_query.limit(limit + 1).to_list()
+    
+    if len(payments) > limit:
+        payments = payments[:limit]
+        if payments:
+            response.headers["X-Next-Cursor"] = encode_cursor(payments[-1].created_at, payments[-1].id)
     
-    payments = await Payment.find(query).skip(offset).limit(limit).to_list()
     return payments
 
 
@@ -144,34 +182,29 @@ async def cancel_payment(payment_id: str) -> dict:
 
 
 @router.get("/{payment_id}/status")
-async def get_payment_status(payment_id: str) -> dict:
-    """Get payment status"""
+async def get_payment_status(payment_id: str, max_age: Optional[int] = None) -> dict:
+    """Get payment status
+    
+    The status is served from the database, which the background reconciler and
+    webhooks keep up to date. Pass max_age (seconds) to force a Chargily check when
+    the last sync is older than that.
+    """
     
     payment = await Payment.get(payment_id)
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
     
-    # If Chargily payment, check status with Chargily
-    if payment.method == "chargily" and payment.chargily_payment_id:
-        try:
-            chargily_status = await chargily_service.get_payment_status(payment.chargily_payment_id)
-            
-            # Update payment status based on Chargily status
-            new_status = chargily_service.map_chargily_status_to_payment_status(chargily_status.status)
-            new_chargily_status = chargily_service.map_chargily_status_to_chargily_status(chargily_status.status)
-            
-            if new_status != payment.status or new_chargily_status != payment.chargily_status:
-                payment.status = new_status
-                payment.chargily_status = new_chargily_status
-                payment.updated_at = datetime.utcnow()
-                
-                if new_status == PaymentStatus.COMPLETED:
-                    payment.completed_at = datetime.utcnow()
-                
-                await payment.save()
-        except Exception as e:
-            # Log error but don't fail the request
-            print(f"Error checking Chargily status: {e}")
+    if (
+        max_age is not None
+        and payment.method == "chargily"
+        and payment.chargily_payment_id
+        and payment.status in NON_TERMINAL_STATUSES
+        and (
+            payment.last_synced_at is None
+            or payment.last_synced_at < datetime.utcnow() - timedelta(seconds=max_age)
+        )
+    ):
+        payment = await payment_reconciler.reconcile_one(payment)
     
     return {
         "payment_id": payment.id,
@@ -181,75 +214,82 @@ async def get_payment_status(payment_id: str) -> dict:
         "currency": payment.currency,
         "method": payment.method,
         "created_at": payment.created_at,
-        "updated_at": payment.updated_at
+        "updated_at": payment.updated_at,
+        "last_synced_at": payment.last_synced_at
     }
 
 
 @router.post("/webhook")
-async def chargily_webhook(
-    request: Request,
-    background_tasks: BackgroundTasks
-) -> dict:
-    """Handle Chargily webhook"""
+async def chargily_webhook(request: Request) -> dict:
+    """Handle Chargily webhook
+    
+    The event is stored in the webhook inbox and acknowledged right away, inbox
+    workers apply it to the payment. Retried deliveries are acknowledged as duplicates.
+    """
     
+    # Get the raw body
+    body = await request.body()
+    signature = request.headers.get("X-Signature", "")
+    payload = body.decode()
+    
+    # Verify signature
+    if not get_chargily_service().verify_webhook_signature(payload, signature):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
+    # Parse webhook data
     try:
-        # Get the raw body
-        body = await request.body()
-        signature = request.headers.get("X-Signature", "")
-        
-        # Verify signature
-        if not chargily_service.verify_webhook_signature(body.decode(), signature):
-            raise HTTPException(status_code=401, detail="Invalid signature")
-        
-        # Parse webhook data
-        webhook_data = await request.json()
-        chargily_data = chargily_service.parse_webhook_data(webhook_data)
-        
-        # Process webhook in background
-        background_tasks.add_task(
-            process_chargily_webhook,
-            chargily_data
-        )
-        
-        return {"status": "success"}
-        
+        chargily_data = get_chargily_service().parse_webhook_data(json.loads(payload))
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid webhook payload: {str(e)}")
+    
+    try:
+        accepted = await webhook_inbox.enqueue(chargily_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Webhook processing failed: {str(e)}")
+    
+    return {"status": "success", "duplicate": not accepted}
+
+
+class WebhookReplayRequest(BaseModel):
+    """Request model for replaying webhook events"""
+    event_ids: Optional[List[str]] = None
+
+
+@router.get("/webhook/events", response_model=List[ChargilyWebhookEvent])
+async def list_webhook_events(
+    status: Optional[WebhookEventStatus] = WebhookEventStatus.FAILED,
+    invoice_id: Optional[str] = None,
+    limit: int = 50
+) -> List[ChargilyWebhookEvent]:
+    """List webhook inbox events, failed ones by default"""
+    
+    query = {}
+    if status:
+        query["status"] = status
+    if invoice_id:
+        query["invoice_id"] = invoice_id
+    
+    return await ChargilyWebhookEvent.find(query).sort("-received_at").limit(limit).to_list()
 
 
-async def process_chargily_webhook(chargily_data: ChargilyWebhookData):
-    """Process Chargily webhook data"""
+@router.post("/webhook/replay")
+async def replay_webhook_events(replay_request: WebhookReplayRequest) -> dict:
+    """Requeue failed webhook events, or the given event IDs"""
     
     try:
-        # Find payment by Chargily payment ID
-        payment = await Payment.find_one({"chargily_payment_id": chargily_data.invoice_id})
-        if not payment:
-            print(f"Payment not found for Chargily invoice: {chargily_data.invoice_id}")
-            return
-        
-        # Update payment status
-        new_status = chargily_service.map_chargily_status_to_payment_status(chargily_data.status)
-        new_chargily_status = chargily_service.map_chargily_status_to_chargily_status(chargily_data.status)
-        
-        payment.status = new_status
-        payment.chargily_status = new_chargily_status
-        payment.chargily_webhook_data = chargily_data.dict()
-        payment.updated_at = datetime.utcnow()
-        
-        if new_status == PaymentStatus.COMPLETED:
-            payment.completed_at = datetime.utcnow()
-        
-        await payment.save()
-        
-        print(f"Payment {payment.id} updated to status {new_status}")
-        
-    except Exception as e:
-        print(f"Error processing Chargily webhook: {e}")
+        requeued = await webhook_inbox.replay(replay_request.event_ids)
+    except exceptions.BadRequest as e:
+        raise HTTPException(status_code=400, detail=e.detail)
+    return {"requeued": requeued}
 
 
 @router.get("/{payment_id}/chargily-url")
-async def get_chargily_payment_url(payment_id: str) -> dict:
-    """Get Chargily payment URL"""
+async def get_chargily_payment_url(payment_id: str, wait: float = 0) -> dict:
+    """Get Chargily payment URL
+    
+    While the link is still being created the response is 202, pass wait (seconds)
+    to long-poll until it is ready.
+    """
     
     payment = await Payment.get(payment_id)
     if not payment:
@@ -258,6 +298,19 @@ async def get_chargily_payment_url(payment_id: str) -> dict:
     if payment.method != "chargily":
         raise HTTPException(status_code=400, detail="Payment is not a Chargily payment")
     
+    if payment.checkout_link_status in IN_PROGRESS_STATUSES and wait > 0:
+        await checkout_link_worker.wait_for_link(payment.id, timeout=min(wait, 30.0))
+        payment = await Payment.get(payment_id)
+    
+    if payment.checkout_link_status in IN_PROGRESS_STATUSES:
+        return JSONResponse(
+            status_code=202,
+            content={"payment_url": None, "status": payment.status, "checkout_link_status": payment.checkout_link_status}
+        )
+    
+    if payment.checkout_link_status == CheckoutLinkStatus.FAILED:
+        raise HTTPException(status_code=502, detail=f"Chargily payment URL could not be created: {payment.checkout_link_error}")
+    
     if not payment.chargily_payment_url:
         raise HTTPException(status_code=400, detail="Chargily payment URL not available")
     
@@ -1,5 +1,8 @@
 import asyncio
-from typing import Dict, Any, List, Optional, TypedDict, Annotated
+import time
+import openai
+import tiktoken
+from typing import Dict, Any, List, Optional, TypedDict, Annotated, AsyncIterator
 from datetime import datetime
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
@@ -8,8 +11,15 @@ from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableLambda
+from beanie import PydanticObjectId
+from pydantic import BaseModel
 from src.models.conversation import Conversation, Message, MessageRole
 from src.models.payament import Payment, PaymentCreate, PaymentMethod
+from src.services.response_cache import response_cache
+from src.services.llm_scheduler import TASK_PRIORITIES, LLMPriority, llm_scheduler
+from src.services.llm_registry import llm_registry
+from src.metrics import AGENT_NODE_DURATION, record_token_usage, track_dependency
+from src.tracing import tracer
 from src.config import settings
 from src.exception import exceptions
 
@@ -23,19 +33,69 @@ class AgentState(TypedDict):
     current_task: Optional[str]
     payment_context: Optional[Dict[str, Any]]
     next_action: Optional[str]
+    node_timings: Dict[str, float]
+    tokens_used: int
+    deadline: float
+    node_deadline: Optional[float]
+    fallbacks: List[Dict[str, Any]]
+    llm_settings: Dict[str, Any]
+    model_used: Optional[str]
+
+
+class AgentReply(BaseModel):
+    """Result of a processed chat turn"""
+    response: str
+    conversation_id: str
+    message_id: str
+    user_message_id: str
+
+
+HANDLER_NODES = ["handle_payment", "handle_recipe", "handle_general"]
+
+FALLBACK_RESPONSE = "Désolé, je n'ai pas pu traiter votre demande."
+
+BUSY_RESPONSE = "Désolé, je suis très sollicité en ce moment. Pouvez-vous réessayer dans un instant ?"
+
+# Failures that send a call to the fallback model instead of failing the turn
+FALLBACK_ERRORS = (
+    asyncio.TimeoutError,
+    exceptions.TooManyRequests,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+def is_fallback_error(error: BaseException) -> bool:
+    """Provider-side failure: the listed errors, or any other 5xx status (4xx are the request's fault)"""
+    if isinstance(error, FALLBACK_ERRORS):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
 
 
 class AIAgentService:
     """Service for handling agentic AI interactions"""
     
     def __init__(self):
-        self.llm = ChatOpenAI(
-            model="gpt-4",
-            temperature=0.7,
-            api_key=settings.openai_api_key
-        )
+        # Default client, handlers pick theirs from the registry per turn
+        self.llm = llm_registry.get(settings.ai_default_model)
+        # Loaded off the event loop at startup, token counts are estimated until then
+        self.encoding: Optional[tiktoken.Encoding] = None
         self.graph = self._build_agent_graph()
     
+    def load_encoding(self) -> None:
+        """Load the tokenizer, blocking (the BPE file is downloaded unless TIKTOKEN_CACHE_DIR has it)"""
+        try:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating token counts: {e}")
+    
+    async def warm_up(self) -> None:
+        """Open a connection to the OpenAI API before the first chat turn needs it"""
+        with track_dependency("openai", "models.list"):
+            await self.llm.root_async_client.models.list()
+    
     def _build_agent_graph(self) -> StateGraph:
         """Build the LangGraph agent workflow"""
         
@@ -43,16 +103,23 @@ class AIAgentService:
         workflow = StateGraph(AgentState)
         
         # Add nodes
-        workflow.add_node("analyze_input", self._analyze_input)
-        workflow.add_node("handle_payment", self._handle_payment)
-        workflow.add_node("handle_recipe", self._handle_recipe)
-        workflow.add_node("handle_general", self._handle_general)
-        workflow.add_node("generate_response", self._generate_response)
+        workflow.add_node("analyze_input", self._timed("analyze_input", self._analyze_input))
+        workflow.add_node("handle_payment", self._timed("handle_payment", self._handle_payment))
+        workflow.add_node("handle_recipe", self._timed("handle_recipe", self._handle_recipe))
+        workflow.add_node("handle_general", self._timed("handle_general", self._handle_general))
+        workflow.add_node("generate_response", self._timed("generate_response", self._generate_response))
         
         # Add edges
-        workflow.add_edge("analyze_input", "handle_payment")
-        workflow.add_edge("analyze_input", "handle_recipe")
-        workflow.add_edge("analyze_input", "handle_general")
+        if settings.ai_graph_mode == "fanout":
+            for node in HANDLER_NODES:
+                workflow.add_edge("analyze_input", node)
+        else:
+            # Only run the handler chosen by analyze_input
+            workflow.add_conditional_edges(
+                "analyze_input",
+                self._route_next_action,
+                {node: node for node in HANDLER_NODES}
+            )
         workflow.add_edge("handle_payment", "generate_response")
         workflow.add_edge("handle_recipe", "generate_response")
         workflow.add_edge("handle_general", "generate_response")
@@ -63,6 +130,41 @@ class AIAgentService:
         
         return workflow.compile()
     
+    def _route_next_action(self, state: AgentState) -> str:
+        """Pick the handler node selected by analyze_input"""
+        next_action = state.get("next_action")
+        if next_action in HANDLER_NODES:
+            return next_action
+        return "handle_general"
+    
+    def _timed(self, name: str, node):
+        """Wrap a graph node so its wall-clock duration is recorded in the state"""
+        
+        async def wrapper(state: AgentState) -> AgentState:
+            started = time.perf_counter()
+            share = settings.ai_node_budget_shares.get(name, 1.0)
+            node_deadline = time.monotonic() + share * settings.ai_turn_budget_seconds
+            if state.get("deadline"):
+                node_deadline = min(node_deadline, state["deadline"])
+            state["node_deadline"] = node_deadline
+            
+            with tracer.start_as_current_span(f"agent.{name}") as span:
+                try:
+                    # The LLM calls fall back within the budget, this only catches what they can't
+                    result = await asyncio.wait_for(node(state), max(0.0, node_deadline - time.monotonic()) + 1.0)
+                except asyncio.TimeoutError:
+                    result = self._canned_reply(state, name, "node_timeout")
+                    span.set_attribute("agent.fallback", "canned")
+                span.set_attribute("agent.task", result.get("current_task") or "")
+            duration = time.perf_counter() - started
+            AGENT_NODE_DURATION.labels(name).observe(duration)
+            node_timings = dict(result.get("node_timings") or {})
+            node_timings[name] = duration
+            result["node_timings"] = node_timings
+            return result
+        
+        return wrapper
+    
     async def _analyze_input(self, state: AgentState) -> AgentState:
         """Analyze user input to determine the appropriate action"""
         
@@ -71,20 +173,47 @@ class AIAgentService:
             state["next_action"] = "handle_general"
             return state
         
-        content = last_message.content.lower()
+        task = self._classify(last_message.content)
+        state["current_task"] = task
+        state["next_action"] = f"handle_{task}"
+        
+        return state
+    
+    def _classify(self, content: str) -> str:
+        """Task of a message, based on keywords"""
         
-        # Determine task type based on keywords
+        content = content.lower()
         if any(keyword in content for keyword in ["payment", "paiement", "pay", "chargily", "card", "cash"]):
-            state["current_task"] = "payment"
-            state["next_action"] = "handle_payment"
-        elif any(keyword in content for keyword in ["recipe", "recette", "cook", "cuisiner", "ingredient", "step"]):
-            state["current_task"] = "recipe"
-            state["next_action"] = "handle_recipe"
-        else:
-            state["current_task"] = "general"
-            state["next_action"] = "handle_general"
+            return "payment"
+        if any(keyword in content for keyword in ["recipe", "recette", "cook", "cuisiner", "ingredient", "step"]):
+            return "recipe"
+        return "general"
+    
+    def _check_turn_capacity(
+        self,
+        message_content: str,
+        requested_model: Optional[str] = None,
+        checked_model: Optional[str] = None
+    ) -> Optional[str]:
+        """Reject a turn early when the lane of the model it will call is full, returns that model"""
+        
+        task = self._classify(message_content)
+        if task == "payment":
+            # Answered without the LLM
+            return None
+        model = llm_registry.route(task, requested_model)
+        if model != checked_model:
+            llm_scheduler.check_capacity(model)
+        return model
+    
+    async def check_capacity(self, conversation_id: str, message_content: str) -> None:
+        """Early capacity check for a turn, before a streamed response is opened"""
         
-        return state
+        # The task's default lane first, without a Mongo read
+        checked_model = self._check_turn_capacity(message_content)
+        conversation = await Conversation.get(conversation_id)
+        if conversation:
+            self._check_turn_capacity(message_content, conversation.ai_model, checked_model)
     
     async def _handle_payment(self, state: AgentState) -> AgentState:
         """Handle payment-related requests"""
@@ -193,6 +322,115 @@ class AIAgentService:
         else:
             return f"Paiement en {payment_context['method']} de {payment_context['amount']} DZD enregistré pour la table {payment_context.get('table_id', 'N/A')}."
     
+    async def _invoke_llm(
+        self,
+        messages: List[BaseMessage],
+        state: AgentState,
+        llm: Optional[ChatOpenAI] = None
+    ) -> str:
+        """Call the LLM through the scheduler and return the response content, counting its tokens in the state"""
+        
+        llm = llm or self.llm
+        priority = TASK_PRIORITIES.get(state.get("current_task"), LLMPriority.GENERAL)
+        estimated_tokens = sum(self._count_tokens(message.content) for message in messages)
+        estimated_tokens += settings.llm_expected_completion_tokens
+        
+        async with llm_scheduler.reserve(llm.model_name, priority, estimated_tokens) as reservation:
+            with track_dependency("openai", "chat"):
+                response = await llm.ainvoke(messages)
+            
+            tokens = record_token_usage(llm.model_name, getattr(response, "usage_metadata", None))
+            reservation.record(tokens)
+        
+        state["tokens_used"] = state.get("tokens_used", 0) + tokens
+        return response.content
+    
+    async def _cached_invoke(
+        self,
+        handler: str,
+        content: str,
+        messages: List[BaseMessage],
+        state: AgentState,
+        llm: ChatOpenAI
+    ) -> str:
+        """Call the LLM through the response cache when the answer doesn't depend on history"""
+        
+        if len(state["messages"]) > 1:
+            return await self._invoke_llm(messages, state, llm)
+        
+        return await response_cache.get_or_generate(
+            prompt=content,
+            handler=handler,
+            model=llm.model_name,
+            temperature=llm.temperature,
+            max_tokens=llm.max_tokens,
+            restaurant_id=state.get("restaurant_id"),
+            generate=lambda: self._invoke_llm(messages, state, llm)
+        )
+    
+    def _select_llm(self, handler: str, state: AgentState, model: Optional[str] = None) -> ChatOpenAI:
+        """Client for a handler, honoring the conversation's model, temperature and max_tokens"""
+        
+        llm_settings = state.get("llm_settings") or {}
+        if model is None:
+            model = llm_registry.route(handler, llm_settings.get("model"))
+        return llm_registry.get(model, llm_settings.get("temperature"), llm_settings.get("max_tokens"))
+    
+    def _canned_reply(self, state: AgentState, node: str, reason: str) -> AgentState:
+        """End a node with the canned reply, recording why"""
+        state["fallbacks"] = [*state.get("fallbacks", []), {"node": node, "reason": reason, "used": "canned"}]
+        state["messages"].append(AIMessage(content=BUSY_RESPONSE))
+        return state
+    
+    async def _invoke_within_budget(
+        self,
+        handler: str,
+        content: str,
+        messages: List[BaseMessage],
+        state: AgentState
+    ) -> str:
+        """Answer within the node budget: main model, then the fallback model, then a canned reply"""
+        
+        node = f"handle_{handler}"
+        node_deadline = state.get("node_deadline") or time.monotonic() + settings.ai_turn_budget_seconds
+        llm = self._select_llm(handler, state)
+        
+        # Keep part of the budget for the fallback model
+        remaining = node_deadline - time.monotonic()
+        primary_budget = remaining - min(settings.ai_fallback_timeout_seconds, remaining / 2)
+        try:
+            if primary_budget <= 0:
+                raise asyncio.TimeoutError()
+            response = await asyncio.wait_for(
+                self._cached_invoke(handler, content, messages, state, llm), primary_budget
+            )
+            state["model_used"] = llm.model_name
+            return response
+        except (*FALLBACK_ERRORS, openai.APIStatusError) as e:
+            if not is_fallback_error(e):
+                raise
+            reason = "timeout" if isinstance(e, (asyncio.TimeoutError, openai.APITimeoutError)) else type(e).__name__
+        
+        fallback_llm = self._select_llm(handler, state, model=settings.ai_fallback_model)
+        try:
+            remaining = node_deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            response = await asyncio.wait_for(
+                self._invoke_llm(messages, state, fallback_llm), remaining
+            )
+            state["model_used"] = fallback_llm.model_name
+            state["fallbacks"] = [
+                *state.get("fallbacks", []),
+                {"node": node, "reason": reason, "used": fallback_llm.model_name}
+            ]
+            return response
+        except (*FALLBACK_ERRORS, openai.APIStatusError) as e:
+            if not is_fallback_error(e):
+                raise
+            state["fallbacks"] = [*state.get("fallbacks", []), {"node": node, "reason": reason, "used": "canned"}]
+            return BUSY_RESPONSE
+    
     async def _generate_recipe_response(self, content: str, state: AgentState) -> str:
         """Generate recipe-specific response"""
         
@@ -201,11 +439,10 @@ class AIAgentService:
         
         messages = [
             SystemMessage(content=system_prompt),
-            HumanMessage(content=content)
+            *state["messages"]
         ]
         
-        response = await self.llm.ainvoke(messages)
-        return response.content
+        return await self._invoke_within_budget("recipe", content, messages, state)
     
     async def _generate_general_response(self, content: str, state: AgentState) -> str:
         """Generate general conversation response"""
@@ -215,22 +452,112 @@ class AIAgentService:
         
         messages = [
             SystemMessage(content=system_prompt),
-            HumanMessage(content=content)
+            *state["messages"]
         ]
         
-        response = await self.llm.ainvoke(messages)
-        return response.content
+        return await self._invoke_within_budget("general", content, messages, state)
     
-    async def process_message(
-        self, 
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens the way the OpenAI models do"""
+        if self.encoding is None:
+            return len(text) // 4 + 4  # ~4 characters per token
+        return len(self.encoding.encode(text)) + 4  # per-message overhead
+    
+    def _summarize_turns(self, messages: List[Message], budget: int) -> Optional[SystemMessage]:
+        """Condense turns that fell out of the window into their clipped questions, newest first"""
+        
+        header = "Résumé des échanges précédents (questions du client) :"
+        budget -= self._count_tokens(header)
+        lines: List[str] = []
+        for message in messages:
+            if message.role != MessageRole.USER:
+                continue
+            line = f"- {message.content[:settings.ai_history_summary_chars]}"
+            budget -= self._count_tokens(line)
+            if budget < 0:
+                break
+            lines.append(line)
+        
+        if not lines:
+            return None
+        lines.reverse()
+        return SystemMessage(content="\n".join([header, *lines]))
+    
+    async def _load_history(self, conversation: Conversation, message_content: str) -> List[BaseMessage]:
+        """Load the most recent turns of a conversation that fit in its token budget, older ones summarized"""
+        
+        if not conversation.message_count:
+            return []
+        
+        budget = conversation.max_tokens or settings.ai_history_token_budget
+        budget -= self._count_tokens(message_content)
+        summary_budget = int(budget * settings.ai_history_summary_share)
+        budget -= summary_budget
+        
+        # Newest first, served by the (conversation_id, created_at) index
+        recent_messages = await Message.find(
+            {"conversation_id": str(conversation.id)}
+        ).sort("-created_at").limit(settings.ai_history_max_messages).to_list()
+        
+        history: List[BaseMessage] = []
+        older: List[Message] = []
+        for index, message in enumerate(recent_messages):
+            if message.role == MessageRole.SYSTEM:
+                continue
+            
+            budget -= self._count_tokens(message.content)
+            if budget < 0:
+                older = recent_messages[index:]
+                break
+            
+            if message.role == MessageRole.USER:
+                history.append(HumanMessage(content=message.content))
+            else:
+                history.append(AIMessage(content=message.content))
+        
+        summary = self._summarize_turns(older, summary_budget) if older else None
+        if summary:
+            history.append(summary)
+        
+        history.reverse()
+        return history
+    
+    def build_state(
+        self,
+        messages: List[BaseMessage],
+        conversation_id: str,
+        user_id: Optional[str],
+        restaurant_id: Optional[str],
+        llm_settings: Optional[Dict[str, Any]] = None
+    ) -> AgentState:
+        """Initial graph state of a turn"""
+        return {
+            "messages": messages,
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "restaurant_id": restaurant_id,
+            "current_task": None,
+            "payment_context": None,
+            "next_action": None,
+            "node_timings": {},
+            "tokens_used": 0,
+            "deadline": time.monotonic() + settings.ai_turn_budget_seconds,
+            "node_deadline": None,
+            "fallbacks": [],
+            "llm_settings": llm_settings or {},
+            "model_used": None
+        }
+    
+    async def _start_turn(
+        self,
         conversation_id: str,
         message_content: str,
-        user_id: Optional[str] = None,
-        restaurant_id: Optional[str] = None
-    ) -> str:
-        """Process a user message and return AI response"""
+        user_id: Optional[str],
+        restaurant_id: Optional[str]
+    ) -> tuple[Conversation, Message, AgentState]:
+        """Load the conversation and build the initial agent state"""
         
-        # Get or create conversation
+        # Get the conversation, it is created when the turn is persisted
         conversation = await Conversation.get(conversation_id)
         if not conversation:
             conversation = Conversation(
@@ -239,50 +566,246 @@ class AIAgentService:
                 restaurant_id=restaurant_id,
                 title="Conversation IA"
             )
-            await conversation.insert()
         
-        # Add user message
+        history = await self._load_history(conversation, message_content)
+        
         user_message = Message(
+            id=PydanticObjectId(),
             conversation_id=conversation_id,
             role=MessageRole.USER,
             content=message_content
         )
-        await user_message.insert()
         
         # Prepare state for the agent
-        state = {
-            "messages": [HumanMessage(content=message_content)],
-            "conversation_id": conversation_id,
-            "user_id": user_id,
-            "restaurant_id": restaurant_id,
-            "current_task": None,
-            "payment_context": None,
-            "next_action": None
-        }
-        
-        # Run the agent
-        result = await self.graph.ainvoke(state)
+        state = self.build_state(
+            [*history, HumanMessage(content=message_content)],
+            conversation_id,
+            user_id,
+            restaurant_id,
+            llm_settings={
+                "model": conversation.ai_model,
+                "temperature": conversation.temperature,
+                "max_tokens": conversation.max_tokens
+            }
+        )
         
-        # Get the AI response
-        ai_response = result["messages"][-1].content if result["messages"] else "Désolé, je n'ai pas pu traiter votre demande."
+        return conversation, user_message, state
+    
+    async def _save_turn(
+        self,
+        conversation: Conversation,
+        messages: List[Message],
+        tokens_used: int
+    ) -> None:
+        """One bulk insert for the messages, one atomic upsert for the conversation"""
+        
+        await Message.insert_many(messages)
+        
+        now = datetime.utcnow()
+        await Conversation.get_pymongo_collection().update_one(
+            {"_id": conversation.id},
+            {
+                "$inc": {"message_count": len(messages), "total_tokens_used": tokens_used},
+                "$set": {"last_activity": now, "updated_at": now},
+                "$setOnInsert": conversation.model_dump(
+                    exclude={"id", "revision_id", "message_count", "total_tokens_used", "last_activity", "updated_at"}
+                )
+            },
+            upsert=True
+        )
+    
+    async def _cancel_turn(
+        self,
+        conversation: Conversation,
+        user_message: Message,
+        state: AgentState,
+        processing_time: float,
+        partial_response: str = ""
+    ) -> None:
+        """Persist what a cancelled turn produced
+        
+        The user message is always kept. A partial answer is kept only when it was
+        streamed to the client, flagged as cancelled in its metadata.
+        """
+        
+        user_message.metadata = {**(user_message.metadata or {}), "cancelled": True}
+        messages = [user_message]
+        if partial_response:
+            messages.append(Message(
+                id=PydanticObjectId(),
+                conversation_id=user_message.conversation_id,
+                role=MessageRole.ASSISTANT,
+                content=partial_response,
+                model_used=state.get("model_used"),
+                tokens_used=state.get("tokens_used") or 0,
+                processing_time=processing_time,
+                metadata={"task": state.get("current_task"), "streamed": True, "cancelled": True}
+            ))
+        
+        try:
+            await self._save_turn(conversation, messages, state.get("tokens_used") or 0)
+        except Exception as e:
+            print(f"Error saving cancelled turn of conversation {user_message.conversation_id}: {e}")
+    
+    async def _finish_turn(
+        self,
+        conversation: Conversation,
+        user_message: Message,
+        ai_response: str,
+        result: Optional[Dict[str, Any]],
+        processing_time: float,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> AgentReply:
+        """Persist both messages of a turn and bump the conversation counters"""
+        
+        result = result or {}
+        tokens_used = result.get("tokens_used") or 0
         
-        # Add AI message to database
         ai_message = Message(
-            conversation_id=conversation_id,
+            id=PydanticObjectId(),
+            conversation_id=user_message.conversation_id,
             role=MessageRole.ASSISTANT,
             content=ai_response,
-            model_used="gpt-4",
-            processing_time=0.0  # Could be calculated
+            model_used=result.get("model_used"),
+            tokens_used=tokens_used,
+            processing_time=processing_time,
+            metadata={
+                "task": result.get("current_task"),
+                "node_timings": result.get("node_timings", {}),
+                "fallbacks": result.get("fallbacks", []),
+                **(metadata or {})
+            }
         )
-        await ai_message.insert()
         
-        # Update conversation
-        conversation.message_count += 1
-        conversation.last_activity = datetime.utcnow()
-        await conversation.save()
+        await self._save_turn(conversation, [user_message, ai_message], tokens_used)
+        
+        return AgentReply(
+            response=ai_response,
+            conversation_id=user_message.conversation_id,
+            message_id=str(ai_message.id),
+            user_message_id=str(user_message.id)
+        )
+    
+    async def process_message(
+        self, 
+        conversation_id: str,
+        message_content: str,
+        user_id: Optional[str] = None,
+        restaurant_id: Optional[str] = None
+    ) -> AgentReply:
+        """Process a user message and return AI response"""
+        
+        # Parent of everything the turn does, its Mongo reads and writes included
+        with tracer.start_as_current_span("agent.turn") as turn_span:
+            turn_span.set_attribute("agent.conversation_id", conversation_id)
+            
+            started = time.perf_counter()
+            # Reject before any Mongo read, then again if the conversation pins another model
+            checked_model = self._check_turn_capacity(message_content)
+            conversation, user_message, state = await self._start_turn(
+                conversation_id, message_content, user_id, restaurant_id
+            )
+            self._check_turn_capacity(message_content, conversation.ai_model, checked_model)
+            
+            # Run the agent, cancelling it aborts the pending OpenAI request
+            try:
+                with tracer.start_as_current_span("agent.graph") as span:
+                    span.set_attribute("agent.conversation_id", conversation_id)
+                    span.set_attribute("agent.history_messages", len(state["messages"]) - 1)
+                    result = await self.graph.ainvoke(state)
+            except asyncio.CancelledError:
+                await asyncio.shield(self._cancel_turn(
+                    conversation, user_message, state, time.perf_counter() - started
+                ))
+                raise
+            
+            # Get the AI response
+            ai_response = result["messages"][-1].content if result["messages"] else FALLBACK_RESPONSE
+            
+            return await self._finish_turn(
+                conversation, user_message, ai_response, result, time.perf_counter() - started
+            )
+    
+    async def stream_message(
+        self,
+        conversation_id: str,
+        message_content: str,
+        user_id: Optional[str] = None,
+        restaurant_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Process a user message, yielding response tokens as the LLM produces them"""
+        
+        started = time.perf_counter()
+        # Reject before any Mongo read, then again if the conversation pins another model
+        checked_model = self._check_turn_capacity(message_content)
+        conversation, user_message, state = await self._start_turn(
+            conversation_id, message_content, user_id, restaurant_id
+        )
+        self._check_turn_capacity(message_content, conversation.ai_model, checked_model)
+        
+        tokens: List[str] = []
+        time_to_first_token = None
+        result = None
+        
+        # The client closing the stream cancels or closes this generator mid-graph
+        try:
+            async for event in self.graph.astream_events(state, version="v2"):
+                kind = event["event"]
+                if kind == "on_chat_model_stream":
+                    content = event["data"]["chunk"].content
+                    if not content:
+                        continue
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - started
+                    tokens.append(content)
+                    yield {"event": "token", "data": {"content": content}}
+                elif kind == "on_chain_end" and event["name"] == self.graph.name:
+                    result = event["data"].get("output")
+        except (asyncio.CancelledError, GeneratorExit):
+            await asyncio.shield(self._cancel_turn(
+                conversation, user_message, state, time.perf_counter() - started, "".join(tokens)
+            ))
+            raise
+        
+        if result and result.get("messages"):
+            ai_response = result["messages"][-1].content
+        else:
+            ai_response = "".join(tokens) or FALLBACK_RESPONSE
+        
+        # Handlers that answer without the LLM (e.g. payments) produce no token events
+        if not tokens:
+            time_to_first_token = time.perf_counter() - started
+            yield {"event": "token", "data": {"content": ai_response}}
+        elif result and result.get("fallbacks") and "".join(tokens) != ai_response:
+            # The main model was cut off mid-answer, the client swaps in the fallback one
+            yield {"event": "replace", "data": {"content": ai_response}}
+        
+        reply = await self._finish_turn(
+            conversation,
+            user_message,
+            ai_response,
+            result,
+            time.perf_counter() - started,
+            metadata={"streamed": True, "time_to_first_token": time_to_first_token}
+        )
         
-        return ai_response
+        yield {
+            "event": "done",
+            "data": {
+                "conversation_id": reply.conversation_id,
+                "message_id": reply.message_id,
+                "response": reply.response,
+                "timestamp": datetime.utcnow()
+            }
+        }
+
+
+_ai_agent_service: Optional[AIAgentService] = None
 
 
-# Global instance
-ai_agent_service = AIAgentService()
+def get_ai_agent_service() -> AIAgentService:
+    """Shared agent service, the graph and LLM client are built on first use"""
+    global _ai_agent_service
+    if _ai_agent_service is None:
+        _ai_agent_service = AIAgentService()
+    return _ai_agent_service
@@ -14,6 +14,8 @@ from src.models.payament import (
 )
 from src.config import settings
 from src.exception import exceptions
+from src.metrics import track_dependency
+from src.tracing import inject_trace_headers
 
 
 class ChargilyService:
@@ -27,6 +29,119 @@ class ChargilyService:
         
         if not self.api_key or not self.secret_key:
             raise ValueError("Chargily API key and secret key are required")
+        
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self._http2 = False
+        self._requests_total = 0
+        self._in_flight = 0
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """Build the pooled HTTP client used for every Chargily call"""
+        
+        http2 = settings.chargily_http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("HTTP/2 requested for Chargily but 'h2' is not installed, using HTTP/1.1")
+                http2 = False
+        
+        # Our own transport, so pool_stats doesn't reach into the client's
+        self._http2 = http2
+        self._transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.chargily_max_connections,
+                max_keepalive_connections=settings.chargily_max_keepalive_connections,
+                keepalive_expiry=settings.chargily_keepalive_expiry
+            )
+        )
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            transport=self._transport,
+            timeout=httpx.Timeout(
+                settings.chargily_timeout_seconds,
+                connect=settings.chargily_connect_timeout_seconds
+            )
+        )
+    
+    async def start(self) -> None:
+        """Open the shared HTTP client (called from the app lifespan)"""
+        if self._client is None:
+            self._client = self._build_client()
+    
+    async def close(self) -> None:
+        """Close the shared HTTP client and its pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._transport = None
+    
+    async def warm_up(self) -> None:
+        """Open a pooled connection to Chargily before the first payment needs it"""
+        await self.start()
+        await self._request("GET", "/balance", headers=self._get_headers(""))
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use when running outside the app lifespan (scripts, tests)
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+    
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request through the pooled client"""
+        
+        # Label by resource, ids would make every checkout its own series
+        operation = f"{method} /{path.strip('/').split('/')[0]}"
+        self._in_flight += 1
+        try:
+            with track_dependency("chargily", operation):
+                kwargs["headers"] = inject_trace_headers(kwargs.get("headers"))
+                return await self.client.request(method, path, **kwargs)
+        finally:
+            self._in_flight -= 1
+            self._requests_total += 1
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool statistics of the shared client"""
+        
+        # The transport keeps its httpcore pool private, connection counts are None if that changes
+        try:
+            connections = list(self._transport._pool.connections)
+            open_connections = len(connections)
+            idle_connections = sum(1 for connection in connections if connection.is_idle())
+        except AttributeError:
+            open_connections = idle_connections = None
+        
+        return {
+            "open": self._client is not None,
+            "http2": self._http2,
+            "max_connections": settings.chargily_max_connections,
+            "max_keepalive_connections": settings.chargily_max_keepalive_connections,
+            "connections": open_connections,
+            "idle_connections": idle_connections,
+            "in_flight_requests": self._in_flight,
+            "total_requests": self._requests_total
+        }
+    
+    def build_payment_request(self, payment: Payment) -> ChargilyPaymentRequest:
+        """Build the Chargily invoice request for a payment"""
+        return ChargilyPaymentRequest(
+            amount=payment.amount,
+            currency=payment.currency,
+            success_url=f"https://your-frontend.com/payment/success?payment_id={payment.id}",
+            failure_url=f"https://your-frontend.com/payment/failure?payment_id={payment.id}",
+            webhook_url=f"https://your-backend.com/api/payments/webhook",
+            invoice_number=f"INV-{payment.transaction_id}",
+            metadata={
+                "payment_id": str(payment.id),
+                "user_id": payment.user_id,
+                "restaurant_id": payment.restaurant_id,
+                "table_id": payment.table_id
+            }
+        )
     
     def _generate_signature(self, data: str) -> str:
         """Generate HMAC signature for Chargily API"""
@@ -70,79 +185,77 @@ class ChargilyService:
         data_json = json.dumps(request_data, separators=(',', ':'))
         headers = self._get_headers(data_json)
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/invoices",
-                    content=data_json,
-                    headers=headers,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                
-                response_data = response.json()
-                
-                return ChargilyPaymentResponse(
-                    checkout_url=response_data["checkout_url"],
-                    invoice_id=response_data["invoice_id"],
-                    invoice_number=response_data["invoice_number"],
-                    amount=response_data["amount"],
-                    currency=response_data["currency"],
-                    status=response_data["status"],
-                    payment_method=response_data["payment_method"],
-                    created_at=response_data["created_at"],
-                    expires_at=response_data["expires_at"]
-                )
-                
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 400:
-                    error_data = e.response.json()
-                    raise exceptions.BadRequest(f"Chargily API error: {error_data.get('message', 'Bad request')}")
-                elif e.response.status_code == 401:
-                    raise exceptions.Unauthorized("Invalid Chargily API credentials")
-                elif e.response.status_code == 403:
-                    raise exceptions.Forbidden("Chargily API access forbidden")
-                else:
-                    raise exceptions.InternalServerError(f"Chargily API error: {e.response.status_code}")
-            except httpx.RequestError as e:
-                raise exceptions.InternalServerError(f"Failed to connect to Chargily: {str(e)}")
+        try:
+            response = await self._request(
+                "POST",
+                "/invoices",
+                content=data_json,
+                headers=headers
+            )
+            response.raise_for_status()
+            
+            response_data = response.json()
+            
+            return ChargilyPaymentResponse(
+                checkout_url=response_data["checkout_url"],
+                invoice_id=response_data["invoice_id"],
+                invoice_number=response_data["invoice_number"],
+                amount=response_data["amount"],
+                currency=response_data["currency"],
+                status=response_data["status"],
+                payment_method=response_data["payment_method"],
+                created_at=response_data["created_at"],
+                expires_at=response_data["expires_at"]
+            )
+            
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 400:
+                error_data = e.response.json()
+                raise exceptions.BadRequest(f"Chargily API error: {error_data.get('message', 'Bad request')}")
+            elif e.response.status_code == 401:
+                raise exceptions.Unauthorized("Invalid Chargily API credentials")
+            elif e.response.status_code == 403:
+                raise exceptions.Forbidden("Chargily API access forbidden")
+            else:
+                raise exceptions.InternalServerError(f"Chargily API error: {e.response.status_code}")
+        except httpx.RequestError as e:
+            raise exceptions.InternalServerError(f"Failed to connect to Chargily: {str(e)}")
     
     async def get_payment_status(self, invoice_id: str) -> ChargilyPaymentResponse:
         """Get payment status from Chargily"""
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    f"{self.base_url}/invoices/{invoice_id}",
-                    headers={
-                        "X-Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                
-                response_data = response.json()
-                
-                return ChargilyPaymentResponse(
-                    checkout_url=response_data["checkout_url"],
-                    invoice_id=response_data["invoice_id"],
-                    invoice_number=response_data["invoice_number"],
-                    amount=response_data["amount"],
-                    currency=response_data["currency"],
-                    status=response_data["status"],
-                    payment_method=response_data["payment_method"],
-                    created_at=response_data["created_at"],
-                    expires_at=response_data["expires_at"]
-                )
-                
-            except httpx.HTTPStatusError as e:
-                if e.response.status_code == 404:
-                    raise exceptions.NotFound("Payment not found")
-                else:
-                    raise exceptions.InternalServerError(f"Chargily API error: {e.response.status_code}")
-            except httpx.RequestError as e:
-                raise exceptions.InternalServerError(f"Failed to connect to Chargily: {str(e)}")
+        try:
+            response = await self._request(
+                "GET",
+                f"/invoices/{invoice_id}",
+                headers={
+                    "X-Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
+            response.raise_for_status()
+            
+            response_data = response.json()
+            
+            return ChargilyPaymentResponse(
+                checkout_url=response_data["checkout_url"],
+                invoice_id=response_data["invoice_id"],
+                invoice_number=response_data["invoice_number"],
+                amount=response_data["amount"],
+                currency=response_data["currency"],
+                status=response_data["status"],
+                payment_method=response_data["payment_method"],
+                created_at=response_data["created_at"],
+                expires_at=response_data["expires_at"]
+            )
+            
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                raise exceptions.NotFound("Payment not found")
+            else:
+                raise exceptions.InternalServerError(f"Chargily API error: {e.response.status_code}")
+        except httpx.RequestError as e:
+            raise exceptions.InternalServerError(f"Failed to connect to Chargily: {str(e)}")
     
     def verify_webhook_signature(self, payload: str, signature: str) -> bool:
         """Verify webhook signature from Chargily"""
@@ -195,5 +308,12 @@ class ChargilyService:
         return status_mapping.get(chargily_status, ChargilyStatus.PENDING)
 
 
-# Global instance
-chargily_service = ChargilyService()
+_chargily_service: Optional[ChargilyService] = None
+
+
+def get_chargily_service() -> ChargilyService:
+    """Shared Chargily service, built on first use so a missing key only fails payment calls"""
+    global _chargily_service
+    if _chargily_service is None:
+        _chargily_service = ChargilyService()
+    return _chargily_service
@@ -0,0 +1,214 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from beanie import PydanticObjectId
+from pymongo import ReturnDocument
+
+from src.models.payament import (
+    CheckoutLinkStatus,
+    ChargilyPaymentResponse,
+    ChargilyStatus,
+    Payment,
+    PaymentMethod,
+    PaymentStatus
+)
+from src.services.chargily_service import get_chargily_service
+from src.config import settings
+from src.exception import exceptions
+
+
+# Links a client may still get, the worker hasn't given up on them
+IN_PROGRESS_STATUSES = [CheckoutLinkStatus.PENDING, CheckoutLinkStatus.CREATING]
+
+# How often a long-polling client re-reads the payment, another replica may create its link
+WAIT_POLL_SECONDS = 1.0
+
+
+class CheckoutLinkWorker:
+    """Creates Chargily checkout links in the background for already stored payments"""
+    
+    def __init__(self, workers: int, lease_seconds: float, max_attempts: int, retry_base_seconds: float):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.owner_id = uuid.uuid4().hex
+        self._queue: "asyncio.Queue[PydanticObjectId]" = asyncio.Queue()
+        self._waiters: Dict[PydanticObjectId, List[asyncio.Event]] = {}
+        self._tasks: List[asyncio.Task] = []
+    
+    def _claimable(self, now: datetime) -> Dict[str, Any]:
+        """Links nobody is creating, or whose creator's lease expired"""
+        return {
+            "status": PaymentStatus.PENDING,
+            "$or": [
+                {"checkout_link_status": CheckoutLinkStatus.PENDING},
+                {
+                    "checkout_link_status": CheckoutLinkStatus.CREATING,
+                    "checkout_link_claimed_at": {"$lt": now - timedelta(seconds=self.lease_seconds)}
+                }
+            ]
+        }
+    
+    async def start(self) -> None:
+        """Start the workers and requeue links left pending by a previous process
+        
+        Every replica requeues them, the atomic claim in create_link lets only one create each.
+        """
+        
+        if self._tasks:
+            return
+        
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        
+        pending = await Payment.find(
+            {"method": PaymentMethod.CHARGILY, **self._claimable(datetime.utcnow())}
+        ).to_list()
+        for payment in pending:
+            self.submit(payment.id)
+    
+    async def stop(self) -> None:
+        """Stop the workers, unfinished links are requeued on next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def submit(self, payment_id: PydanticObjectId) -> None:
+        """Queue checkout link creation for a stored payment"""
+        self._queue.put_nowait(payment_id)
+    
+    async def wait_for_link(self, payment_id: PydanticObjectId, timeout: float) -> None:
+        """Wait until the link of a payment is ready or failed, or the timeout"""
+        
+        deadline = time.monotonic() + timeout
+        event = asyncio.Event()
+        self._waiters.setdefault(payment_id, []).append(event)
+        try:
+            while True:
+                # Registered before reading, a link finished in between still wakes us
+                payment = await Payment.get(payment_id)
+                if not payment or payment.checkout_link_status not in IN_PROGRESS_STATUSES:
+                    return
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(remaining, WAIT_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters = self._waiters.get(payment_id)
+            if waiters is not None:
+                waiters.remove(event)
+                if not waiters:
+                    del self._waiters[payment_id]
+    
+    def _notify(self, payment_id: PydanticObjectId) -> None:
+        for event in self._waiters.get(payment_id, []):
+            event.set()
+    
+    async def _worker(self) -> None:
+        while True:
+            payment_id = await self._queue.get()
+            try:
+                await self.create_link(payment_id)
+            except Exception as e:
+                print(f"Error creating Chargily checkout link for payment {payment_id}: {e}")
+            finally:
+                self._notify(payment_id)
+                self._queue.task_done()
+    
+    async def _claim(self, payment_id: PydanticObjectId) -> Optional[Payment]:
+        """Atomically take over the link creation of a payment, None when not claimable"""
+        
+        now = datetime.utcnow()
+        document = await Payment.get_pymongo_collection().find_one_and_update(
+            {"_id": payment_id, **self._claimable(now)},
+            {
+                "$set": {
+                    "checkout_link_status": CheckoutLinkStatus.CREATING,
+                    "checkout_link_owner": self.owner_id,
+                    "checkout_link_claimed_at": now
+                }
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        return Payment.model_validate(document) if document else None
+    
+    async def _create_invoice(self, payment: Payment) -> ChargilyPaymentResponse:
+        """Create the Chargily invoice, retrying server errors, timeouts and connection errors"""
+        
+        chargily_service = get_chargily_service()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await chargily_service.create_payment(
+                    chargily_service.build_payment_request(payment),
+                    str(payment.id)
+                )
+            except exceptions.InternalServerError as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.retry_base_seconds * 2 ** (attempt - 1)
+                print(f"Chargily checkout link attempt {attempt} for payment {payment.id} failed: {e}, retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                
+                # Renew the lease so no other worker takes the link over meanwhile
+                await Payment.get_pymongo_collection().update_one(
+                    {"_id": payment.id, "checkout_link_owner": self.owner_id},
+                    {"$set": {"checkout_link_claimed_at": datetime.utcnow()}}
+                )
+    
+    async def create_link(self, payment_id: PydanticObjectId) -> Optional[Payment]:
+        """Create the Chargily invoice of a payment and store its checkout link"""
+        
+        payment = await self._claim(payment_id)
+        if payment is None:
+            # Already done, cancelled, or being created by another worker
+            return await Payment.get(payment_id)
+        
+        try:
+            chargily_response = await self._create_invoice(payment)
+            now = datetime.utcnow()
+            changes = {
+                "chargily_payment_id": chargily_response.invoice_id,
+                "chargily_payment_url": chargily_response.checkout_url,
+                "chargily_status": ChargilyStatus.PENDING,
+                "status": PaymentStatus.PROCESSING,
+                "checkout_link_status": CheckoutLinkStatus.READY,
+                "expires_at": now + timedelta(hours=24),
+                "updated_at": now
+            }
+        except Exception as e:
+            changes = {
+                "status": PaymentStatus.FAILED,
+                "checkout_link_status": CheckoutLinkStatus.FAILED,
+                "checkout_link_error": str(e),
+                "updated_at": datetime.utcnow()
+            }
+        
+        # The payment may have been cancelled, or taken over after an expired lease, meanwhile
+        await Payment.get_pymongo_collection().update_one(
+            {"_id": payment.id, "status": PaymentStatus.PENDING, "checkout_link_owner": self.owner_id},
+            {"$set": changes}
+        )
+        return payment
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Queue depth and number of long-polling clients"""
+        return {
+            "queued": self._queue.qsize(),
+            "waiting_clients": sum(len(waiters) for waiters in self._waiters.values())
+        }
+
+
+# Global instance
+checkout_link_worker = CheckoutLinkWorker(
+    workers=settings.chargily_checkout_workers,
+    lease_seconds=settings.chargily_checkout_lease_seconds,
+    max_attempts=settings.chargily_checkout_max_attempts,
+    retry_base_seconds=settings.chargily_checkout_retry_base_seconds
+)
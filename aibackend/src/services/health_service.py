@@ -0,0 +1,167 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from src.config import settings
+from src.minio import IMAGES_BUCKET_NAME, Bucket
+from src.models.conversation import Conversation
+from src.readiness import readiness_gate
+from src.services.ai_agent_service import get_ai_agent_service
+from src.services.chargily_service import get_chargily_service
+
+
+# Readiness fails when one of these is down, the others only degrade it
+CRITICAL_CHECKS = ["mongo", "minio"]
+
+
+class CheckResult:
+    """Outcome of one dependency check"""
+    
+    def __init__(self, healthy: bool, latency: float, error: Optional[str] = None):
+        self.healthy = healthy
+        self.latency = latency
+        self.error = error
+        self.checked_at = datetime.utcnow()
+        self._monotonic = time.monotonic()
+    
+    def age(self) -> float:
+        return time.monotonic() - self._monotonic
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            "latency_ms": round(self.latency * 1000, 1),
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
+
+
+class HealthService:
+    """Cheap dependency checks for the probes, cached so frequent probes don't hit the dependencies"""
+    
+    def __init__(self):
+        self.checks: Dict[str, Callable[[], Awaitable[None]]] = {
+            "mongo": self._check_mongo,
+            "minio": self._check_minio,
+            "chargily": self._check_chargily,
+            "openai": self._check_openai,
+        }
+        self._results: Dict[str, CheckResult] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self._deep_task: Optional[asyncio.Task] = None
+        self.deep_result: Optional[CheckResult] = None
+    
+    async def _check_mongo(self) -> None:
+        await Conversation.get_pymongo_collection().database.command("ping")
+    
+    async def _check_minio(self) -> None:
+        if not await Bucket.client.bucket_exists(IMAGES_BUCKET_NAME):
+            raise RuntimeError(f"Bucket {IMAGES_BUCKET_NAME} is missing")
+    
+    async def _check_chargily(self) -> None:
+        if not settings.chargily_configured:
+            raise RuntimeError("Chargily is not configured")
+        
+        # Any answer below 500 means the API is reachable
+        chargily_service = get_chargily_service()
+        response = await chargily_service._request("GET", "/balance", headers=chargily_service._get_headers(""))
+        if response.status_code >= 500:
+            raise RuntimeError(f"Chargily answered {response.status_code}")
+    
+    async def _check_openai(self) -> None:
+        # Listing models is free, no completion is generated
+        ai_agent_service = await asyncio.to_thread(get_ai_agent_service)
+        await ai_agent_service.warm_up()
+    
+    async def _run_check(self, name: str) -> CheckResult:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.checks[name](), settings.health_check_timeout_seconds)
+            result = CheckResult(True, time.perf_counter() - started)
+        except Exception as e:
+            error = "timed out" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+            result = CheckResult(False, time.perf_counter() - started, error)
+        
+        self._results[name] = result
+        return result
+    
+    async def check(self, name: str) -> CheckResult:
+        """Result of a check, run again only once the cached one is older than the TTL"""
+        
+        cached = self._results.get(name)
+        if cached is not None and cached.age() < settings.health_cache_ttl_seconds:
+            return cached
+        
+        # Concurrent probes share one run
+        running = self._running.get(name)
+        if running is None:
+            running = asyncio.create_task(self._run_check(name))
+            self._running[name] = running
+            running.add_done_callback(lambda _: self._running.pop(name, None))
+        return await asyncio.shield(running)
+    
+    async def check_all(self, names: Optional[List[str]] = None) -> Dict[str, CheckResult]:
+        names = names or list(self.checks)
+        results = await asyncio.gather(*(self.check(name) for name in names))
+        return dict(zip(names, results))
+    
+    async def readiness(self) -> Dict[str, Any]:
+        """Readiness report, ready when started and every critical check passes"""
+        
+        if not readiness_gate.is_ready:
+            return {"ready": False, "status": "starting", "error": readiness_gate.error, "checks": {}}
+        
+        results = await self.check_all()
+        ready = all(results[name].healthy for name in CRITICAL_CHECKS)
+        degraded = not all(result.healthy for result in results.values())
+        
+        report = {
+            "ready": ready,
+            "status": "unavailable" if not ready else "degraded" if degraded else "ready",
+            "checks": {name: result.to_dict() for name, result in results.items()},
+        }
+        if self.deep_result is not None:
+            report["deep_check"] = self.deep_result.to_dict()
+        return report
+    
+    async def _deep_check(self) -> None:
+        """Run one agent turn without persisting it"""
+        
+        started = time.perf_counter()
+        try:
+            ai_agent_service = await asyncio.to_thread(get_ai_agent_service)
+            state = ai_agent_service.build_state(
+                [HumanMessage(content="Bonjour")], "health_check", "system", "system"
+            )
+            result = await asyncio.wait_for(
+                ai_agent_service.graph.ainvoke(state),
+                settings.health_deep_check_timeout_seconds
+            )
+            if not result.get("messages"):
+                raise RuntimeError("The agent produced no response")
+            self.deep_result = CheckResult(True, time.perf_counter() - started)
+        except Exception as e:
+            self.deep_result = CheckResult(False, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+    
+    async def _run_deep_checks(self) -> None:
+        while True:
+            await self._deep_check()
+            await asyncio.sleep(settings.health_deep_check_interval_seconds)
+    
+    async def start(self) -> None:
+        """Start the periodic deep check (called from the app lifespan when enabled)"""
+        if self._deep_task is None:
+            self._deep_task = asyncio.create_task(self._run_deep_checks())
+    
+    async def stop(self) -> None:
+        if self._deep_task is not None:
+            self._deep_task.cancel()
+            await asyncio.gather(self._deep_task, return_exceptions=True)
+            self._deep_task = None
+
+
+# Global instance
+health_service = HealthService()
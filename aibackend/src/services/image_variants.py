@@ -0,0 +1,88 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from src.config import settings
+
+
+# name -> (longest side in pixels, output format), None keeps the original
+VARIANTS: Dict[str, Tuple[Optional[int], Optional[str]]] = {
+    "thumbnail": (320, None),
+    "medium": (1024, None),
+    "webp": (None, "WEBP"),
+}
+
+# Formats Pillow can resize, svg and icons are served as they are
+RASTER_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif", "image/apng"}
+
+FORMAT_CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+VARIANT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def variant_object_name(object_name: str, variant: str) -> str:
+    """Deterministic name of a variant, stored next to the original"""
+    return f"{object_name}@{variant}"
+
+
+def render_variant(data: bytes, max_size: Optional[int], image_format: Optional[str]) -> Tuple[bytes, str]:
+    """Resize and re-encode an image, runs in a worker process"""
+    
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        if max_size:
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        
+        if image_format is None:
+            has_alpha = image.mode in ("RGBA", "LA", "P")
+            image_format = "PNG" if has_alpha else "JPEG"
+        if image_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        output = io.BytesIO()
+        image.save(output, image_format, quality=82, optimize=True)
+        return output.getvalue(), FORMAT_CONTENT_TYPES[image_format]
+
+
+class ImageVariantRenderer:
+    """Renders image variants in a process pool so the event loop isn't blocked"""
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking would copy the Mongo, OTel and executor threads' locks into the workers
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+    
+    async def render(self, data: bytes, variant: str) -> Tuple[bytes, str]:
+        """Render one variant of an image, returns its bytes and content type"""
+        
+        max_size, image_format = VARIANTS[variant]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_pool(), render_variant, data, max_size, image_format
+        )
+    
+    def shutdown(self) -> None:
+        """Stop the worker processes (called from the app lifespan)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Global instance
+image_variant_renderer = ImageVariantRenderer(workers=settings.image_variant_workers)
@@ -0,0 +1,59 @@
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from src.config import settings
+
+
+class LLMRegistry:
+    """Shared ChatOpenAI clients keyed by (model, temperature, max_tokens), so connection pools are reused"""
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, float, Optional[int]], ChatOpenAI] = {}
+
+    def get(self, model: str, temperature: Optional[float] = None, max_tokens: Optional[int] = None) -> ChatOpenAI:
+        """Client for a model and sampling settings, built on first use"""
+
+        if temperature is None:
+            temperature = settings.ai_default_temperature
+        key = (model, round(temperature, 2), max_tokens)
+
+        client = self._clients.get(key)
+        if client is None:
+            client = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                api_key=settings.openai_api_key,
+                timeout=settings.openai_timeout_seconds,
+                max_retries=settings.openai_max_retries,
+                stream_usage=True
+            )
+            self._clients[key] = client
+        return client
+
+    def route(self, handler: str, requested_model: Optional[str] = None) -> str:
+        """Model for a handler: the conversation's model when allowed, else the routing policy"""
+
+        # Conversations created before routing stored the old default, it isn't a choice
+        if requested_model == settings.ai_legacy_default_model:
+            requested_model = None
+        if requested_model and requested_model in settings.ai_allowed_models:
+            return requested_model
+        return settings.ai_model_routes.get(handler, settings.ai_default_model)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "default_model": settings.ai_default_model,
+            "fallback_model": settings.ai_fallback_model,
+            "routes": settings.ai_model_routes,
+            "allowed_models": settings.ai_allowed_models,
+            "clients": [
+                {"model": model, "temperature": temperature, "max_tokens": max_tokens}
+                for model, temperature, max_tokens in self._clients
+            ],
+        }
+
+
+# Global instance
+llm_registry = LLMRegistry()
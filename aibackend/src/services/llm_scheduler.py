@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from src.config import settings
+from src.exception import exceptions
+from src.metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT
+
+
+class LLMPriority(IntEnum):
+    """Scheduling class of an LLM call, lower goes first (payment turns never call the LLM)"""
+    GENERAL = 0
+    RECIPE = 1
+
+
+TASK_PRIORITIES = {
+    "general": LLMPriority.GENERAL,
+    "recipe": LLMPriority.RECIPE,
+}
+
+
+class _Waiter:
+    def __init__(self, priority: LLMPriority, tokens: int, deadline: float):
+        self.priority = priority
+        self.tokens = tokens
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class Reservation:
+    """Admitted LLM call, holds one concurrency slot and its estimated tokens"""
+    
+    def __init__(self, tokens: int, entry: list):
+        self.tokens = tokens
+        self._entry = entry
+    
+    def record(self, tokens: int) -> None:
+        """Replace the estimate with the tokens the provider reported"""
+        if tokens:
+            self._entry[1] = tokens
+            self.tokens = tokens
+
+
+class _ModelLane:
+    """Concurrency slots, token budget and wait queue of one model"""
+    
+    def __init__(self, model: str, max_concurrency: int, tokens_per_minute: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.active = 0
+        # Ordered by priority class, then earliest deadline
+        self._queue: List[Tuple[int, float, int, _Waiter]] = []
+        self._counter = itertools.count()
+        # [admitted_at, tokens] of the calls of the last minute
+        self._usage: Deque[list] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        
+        # Stats
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    @property
+    def queued(self) -> int:
+        return sum(1 for *_, waiter in self._queue if not waiter.future.done())
+    
+    def tokens_last_minute(self) -> int:
+        cutoff = time.monotonic() - 60
+        while self._usage and self._usage[0][0] < cutoff:
+            self._usage.popleft()
+        return sum(tokens for _, tokens in self._usage)
+    
+    def _has_budget(self, tokens: int) -> bool:
+        used = self.tokens_last_minute()
+        # A call larger than the whole budget still runs once the window is empty
+        return used + tokens <= self.tokens_per_minute or not self._usage
+    
+    def push(self, waiter: _Waiter) -> None:
+        heapq.heappush(self._queue, (waiter.priority, waiter.deadline, next(self._counter), waiter))
+        self.dispatch()
+    
+    def _admit(self, waiter: _Waiter) -> None:
+        entry = [time.monotonic(), waiter.tokens]
+        self._usage.append(entry)
+        self.active += 1
+        self.admitted += 1
+        wait = time.monotonic() - waiter.enqueued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        LLM_QUEUE_WAIT.labels(self.model, waiter.priority.name.lower()).observe(wait)
+        waiter.future.set_result(Reservation(waiter.tokens, entry))
+    
+    def dispatch(self) -> None:
+        """Admit queued calls while a slot and enough token budget are free"""
+        
+        while self._queue and self.active < self.max_concurrency:
+            *_, waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if not self._has_budget(waiter.tokens):
+                self._retry_when_budget_frees()
+                break
+            heapq.heappop(self._queue)
+            self._admit(waiter)
+        
+        LLM_QUEUE_DEPTH.labels(self.model).set(self.queued)
+    
+    def _retry_when_budget_frees(self) -> None:
+        if self._timer is not None or not self._usage:
+            return
+        delay = max(0.0, self._usage[0][0] + 60 - time.monotonic())
+        
+        def retry():
+            self._timer = None
+            self.dispatch()
+        
+        self._timer = asyncio.get_running_loop().call_later(delay + 0.01, retry)
+    
+    def release(self) -> None:
+        self.active -= 1
+        self.dispatch()
+    
+    def get_stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "active": self.active,
+            "queued": self.queued,
+            "tokens_last_minute": self.tokens_last_minute(),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_seconds": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 4),
+        }
+
+
+class LLMScheduler:
+    """Bounds concurrent LLM calls per model and orders waiting calls by priority and deadline"""
+    
+    def __init__(self):
+        self._lanes: Dict[str, _ModelLane] = {}
+    
+    def _lane(self, model: str) -> _ModelLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            lane = _ModelLane(
+                model,
+                settings.llm_model_concurrency.get(model, settings.llm_max_concurrency),
+                settings.llm_model_tokens_per_minute.get(model, settings.llm_tokens_per_minute),
+            )
+            self._lanes[model] = lane
+        return lane
+    
+    def check_capacity(self, model: str) -> None:
+        """Reject early, before any work is done for a request, when the queue is full"""
+        
+        lane = self._lane(model)
+        if lane.queued >= settings.llm_max_queue_depth:
+            lane.rejected += 1
+            raise exceptions.TooManyRequests("The assistant is busy, please retry shortly", retry_after=2)
+    
+    @asynccontextmanager
+    async def reserve(
+        self,
+        model: str,
+        priority: LLMPriority,
+        tokens: int,
+        timeout: Optional[float] = None
+    ) -> AsyncIterator[Reservation]:
+        """Wait for a slot of the model, raises TooManyRequests when full or past the deadline"""
+        
+        self.check_capacity(model)
+        lane = self._lane(model)
+        
+        if timeout is None:
+            timeout = settings.llm_queue_timeout_seconds
+        waiter = _Waiter(priority, tokens, time.monotonic() + timeout)
+        lane.push(waiter)
+        
+        try:
+            reservation = await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted while giving up, hand the slot back
+                lane.release()
+            else:
+                waiter.future.cancel()
+                lane.dispatch()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            lane.timed_out += 1
+            raise exceptions.TooManyRequests("The assistant is busy, please retry shortly", retry_after=5)
+        
+        try:
+            yield reservation
+        finally:
+            lane.release()
+    
+    def get_stats(self) -> dict:
+        return {model: lane.get_stats() for model, lane in self._lanes.items()}
+
+
+# Global instance
+llm_scheduler = LLMScheduler()
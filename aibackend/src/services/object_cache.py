@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
+
+import aiofiles
+
+from src.config import settings
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CachedObject:
+    """An object body kept on local disk"""
+    
+    def __init__(self, path: str, size: int, etag: str):
+        self.path = path
+        self.size = size
+        self.etag = etag
+
+
+class ObjectDiskCache:
+    """Read-through cache of small, hot MinIO objects on local disk, evicted LRU by size"""
+    
+    def __init__(self, directory: str, max_bytes: int, max_object_bytes: int, processes: int = 1):
+        # Each server process owns a subdirectory and an equal share of the size budget,
+        # so no process removes files another one is serving
+        self.root = directory
+        self.directory = os.path.join(directory, str(os.getpid()))
+        self.max_bytes = max_bytes // max(processes, 1)
+        self.max_object_bytes = max_object_bytes
+        self._entries: "OrderedDict[str, CachedObject]" = OrderedDict()
+        self._filling: Dict[str, asyncio.Future] = {}
+        self._prepared = False
+        self.total_bytes = 0
+        
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def _prepare(self) -> None:
+        if self._prepared:
+            return
+        
+        # Entries from a previous run are unknown, start from an empty directory
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        
+        # Drop the directories of processes that are gone, live ones are left alone
+        for name in os.listdir(self.root):
+            if name.isdigit() and int(name) != os.getpid() and not _process_alive(int(name)):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        self._prepared = True
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+    
+    def cacheable(self, size: int) -> bool:
+        return settings.object_cache_enabled and 0 < size <= self.max_object_bytes
+    
+    def get(self, key: str, etag: str) -> Optional[CachedObject]:
+        """Cached copy of an object, only if it still has the given ETag"""
+        
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        if not os.path.exists(entry.path):
+            # Removed behind our back, e.g. by a tmp cleaner
+            self._entries.pop(key, None)
+            self.total_bytes -= entry.size
+            self.misses += 1
+            return None
+        
+        if entry.etag != etag:
+            # Changed in MinIO by another process
+            self.invalidate(key)
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    async def fill(self, key: str, etag: str, chunks: AsyncIterator[bytes]) -> Optional[CachedObject]:
+        """Write an object to disk, concurrent fills of the same key share one download"""
+        
+        filling = self._filling.get(key)
+        if filling is not None:
+            await asyncio.shield(filling)
+            return self._entries.get(key)
+        
+        filling = asyncio.get_running_loop().create_future()
+        self._filling[key] = filling
+        try:
+            entry = await self._write(key, etag, chunks)
+            filling.set_result(None)
+            return entry
+        except BaseException as e:
+            filling.set_result(None)
+            if isinstance(e, Exception):
+                print(f"Error caching object {key}: {e}")
+                return None
+            raise
+        finally:
+            self._filling.pop(key, None)
+    
+    async def _write(self, key: str, etag: str, chunks: AsyncIterator[bytes]) -> CachedObject:
+        self._prepare()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    await f.write(chunk)
+            
+            # The new file takes the path of the previous copy
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        entry = CachedObject(path, size, etag)
+        self._entries[key] = entry
+        self.total_bytes += size
+        self._evict()
+        return entry
+    
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._remove(entry)
+            self.evictions += 1
+    
+    def _remove(self, entry: CachedObject) -> None:
+        self.total_bytes -= entry.size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    
+    def invalidate(self, key: str) -> None:
+        """Forget an object after it was overwritten or deleted"""
+        
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._remove(entry)
+    
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.object_cache_enabled,
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "directory": self.directory,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Global instance
+object_disk_cache = ObjectDiskCache(
+    directory=settings.object_cache_dir,
+    max_bytes=settings.object_cache_max_mb * 1024 * 1024,
+    max_object_bytes=settings.object_cache_max_object_mb * 1024 * 1024,
+    processes=settings.object_cache_processes,
+)
@@ -0,0 +1,147 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+from pymongo import UpdateOne
+
+from src.models.payament import NON_TERMINAL_STATUSES, Payment, PaymentMethod, PaymentStatus
+from src.services.chargily_service import get_chargily_service
+from src.config import settings
+
+
+class PaymentReconciler:
+    """Background sweeper that syncs non-terminal Chargily payments"""
+    
+    def __init__(self, interval_seconds: float, batch_size: int, concurrency: int):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task: Optional[asyncio.Task] = None
+        self.last_sweep: Dict[str, Any] = {}
+    
+    async def start(self) -> None:
+        """Start the periodic sweep (called from the app lifespan)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop the periodic sweep"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error reconciling Chargily payments: {e}")
+            await asyncio.sleep(self.interval_seconds)
+    
+    def _build_changes(self, payment: Payment, chargily_status: Optional[str], now: datetime) -> Dict[str, Any]:
+        """Fields to set on a payment given its latest Chargily status, None when it could not be fetched"""
+        
+        changes: Dict[str, Any] = {"last_sync_attempt_at": now}
+        if chargily_status is None:
+            # A failed check says nothing about the status, it must not look fresh
+            return changes
+        
+        changes["last_synced_at"] = now
+        if payment.expires_at and payment.expires_at < now and chargily_status == "pending":
+            chargily_status = "expired"
+        
+        chargily_service = get_chargily_service()
+        new_status = chargily_service.map_chargily_status_to_payment_status(chargily_status)
+        new_chargily_status = chargily_service.map_chargily_status_to_chargily_status(chargily_status)
+        
+        if new_status != payment.status or new_chargily_status != payment.chargily_status:
+            changes["status"] = new_status
+            changes["chargily_status"] = new_chargily_status
+            changes["updated_at"] = now
+            if new_status == PaymentStatus.COMPLETED:
+                changes["completed_at"] = now
+        
+        return changes
+    
+    async def _fetch_status(self, payment: Payment, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """Latest Chargily status of a payment, "expired" past its expiry, None when the check failed"""
+        
+        # Past expiry there is nothing to ask Chargily
+        if payment.expires_at and payment.expires_at < datetime.utcnow():
+            return "expired"
+        
+        async with semaphore:
+            try:
+                response = await get_chargily_service().get_payment_status(payment.chargily_payment_id)
+                return response.status
+            except Exception as e:
+                print(f"Error checking Chargily status for payment {payment.id}: {e}")
+                return None
+    
+    async def sweep(self) -> Dict[str, Any]:
+        """Check one batch of the least recently checked non-terminal payments"""
+        
+        payments = await Payment.find(
+            {
+                "method": PaymentMethod.CHARGILY,
+                "status": {"$in": NON_TERMINAL_STATUSES},
+                "chargily_payment_id": {"$ne": None}
+            }
+        ).sort("last_sync_attempt_at").limit(self.batch_size).to_list()
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        statuses = await asyncio.gather(
+            *(self._fetch_status(payment, semaphore) for payment in payments)
+        )
+        
+        now = datetime.utcnow()
+        operations: List[UpdateOne] = []
+        changed = 0
+        for payment, chargily_status in zip(payments, statuses):
+            changes = self._build_changes(payment, chargily_status, now)
+            if "status" in changes:
+                changed += 1
+            # Only touch payments a webhook hasn't finalized in the meantime
+            operations.append(UpdateOne(
+                {"_id": payment.id, "status": {"$in": NON_TERMINAL_STATUSES}},
+                {"$set": changes}
+            ))
+        
+        if operations:
+            await Payment.get_pymongo_collection().bulk_write(operations, ordered=False)
+        
+        self.last_sweep = {
+            "finished_at": now,
+            "checked": len(payments),
+            "changed": changed
+        }
+        return self.last_sweep
+    
+    async def reconcile_one(self, payment: Payment) -> Payment:
+        """Sync a single payment right away"""
+        
+        chargily_status = await self._fetch_status(payment, asyncio.Semaphore(1))
+        changes = self._build_changes(payment, chargily_status, datetime.utcnow())
+        
+        result = await Payment.get_pymongo_collection().update_one(
+            {"_id": payment.id, "status": {"$in": NON_TERMINAL_STATUSES}},
+            {"$set": changes}
+        )
+        if not result.modified_count:
+            # Finalized concurrently, e.g. by a webhook
+            return await Payment.get(payment.id) or payment
+        
+        for field, value in changes.items():
+            setattr(payment, field, value)
+        return payment
+
+
+# Global instance
+payment_reconciler = PaymentReconciler(
+    interval_seconds=settings.payment_reconciler_interval_seconds,
+    batch_size=settings.payment_reconciler_batch_size,
+    concurrency=settings.payment_reconciler_concurrency
+)
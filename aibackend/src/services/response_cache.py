@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.models.response_cache import CachedResponse
+from src.config import settings
+
+
+class ResponseCache:
+    """Two-tier (in-process LRU + MongoDB) cache for LLM responses"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            "memory_hits": 0,
+            "mongo_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0
+        }
+    
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """Normalize a prompt so trivially different phrasings share an entry"""
+        
+        # Strip accents, case, punctuation and extra whitespace
+        prompt = unicodedata.normalize("NFKD", prompt)
+        prompt = "".join(char for char in prompt if not unicodedata.combining(char))
+        prompt = re.sub(r"[^\w\s]", " ", prompt.lower())
+        return " ".join(prompt.split())
+    
+    def make_key(
+        self,
+        prompt: str,
+        handler: str,
+        model: str,
+        restaurant_id: Optional[str],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Build the cache key for a prompt, the sampling settings included"""
+        raw = "\x1f".join([
+            self.normalize_prompt(prompt),
+            handler,
+            model,
+            restaurant_id or "",
+            "" if temperature is None else f"{temperature:.2f}",
+            "" if max_tokens is None else str(max_tokens)
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        
+        self._entries.move_to_end(key)
+        return response
+    
+    def _set_memory(self, key: str, response: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+    
+    async def _get_persistent(self, key: str) -> Optional[str]:
+        try:
+            cached = await CachedResponse.find_one(
+                {"key": key, "expires_at": {"$gt": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print(f"Error reading response cache: {e}")
+            return None
+        return cached.response if cached else None
+    
+    async def _set_persistent(
+        self,
+        key: str,
+        handler: str,
+        model: str,
+        restaurant_id: Optional[str],
+        response: str
+    ) -> None:
+        now = datetime.utcnow()
+        try:
+            await CachedResponse.get_pymongo_collection().update_one(
+                {"key": key},
+                {
+                    "$set": {
+                        "handler": handler,
+                        "model": model,
+                        "restaurant_id": restaurant_id,
+                        "response": response,
+                        "created_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds)
+                    }
+                },
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error writing response cache: {e}")
+    
+    async def get_or_generate(
+        self,
+        prompt: str,
+        handler: str,
+        model: str,
+        restaurant_id: Optional[str],
+        generate: Callable[[], Awaitable[str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None
+    ) -> str:
+        """Return a cached response, or generate it once for all concurrent callers"""
+        
+        if not settings.ai_cache_enabled:
+            return await generate()
+        
+        key = self.make_key(prompt, handler, model, restaurant_id, temperature, max_tokens)
+        
+        response = self._get_memory(key)
+        if response is not None:
+            self.stats["memory_hits"] += 1
+            return response
+        
+        # Single-flight: wait for an identical request that is already running
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                response = await asyncio.shield(inflight)
+                self.stats["shared_hits"] += 1
+                return response
+            except Exception:
+                # The leading request failed, generate on our own
+                return await generate()
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self._get_persistent(key)
+            if response is not None:
+                self.stats["mongo_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                response = await generate()
+                await self._set_persistent(key, handler, model, restaurant_id, response)
+            
+            self._set_memory(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Cache request cancelled"))
+            future.exception()  # Mark as retrieved when nobody was waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        
+        lookups = sum(self.stats.values()) - self.stats["evictions"]
+        hits = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_ratio": hits / lookups if lookups else 0.0
+        }
+    
+    def clear(self) -> None:
+        """Drop the in-process tier"""
+        self._entries.clear()
+
+
+# Global instance
+response_cache = ResponseCache(
+    max_entries=settings.ai_cache_max_entries,
+    ttl_seconds=settings.ai_cache_ttl_seconds
+)
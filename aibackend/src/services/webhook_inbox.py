@@ -0,0 +1,261 @@
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta
+from beanie import PydanticObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from src.models.payament import (
+    ChargilyWebhookData,
+    ChargilyWebhookEvent,
+    NON_TERMINAL_STATUSES,
+    Payment,
+    PaymentStatus,
+    WebhookEventStatus
+)
+from src.services.chargily_service import get_chargily_service
+from src.config import settings
+from src.exception import exceptions
+
+
+class WebhookInbox:
+    """Durable inbox for Chargily webhooks drained by a bounded worker pool"""
+    
+    def __init__(
+        self,
+        workers: int,
+        batch_size: int,
+        lease_seconds: float,
+        max_attempts: int,
+        retry_base_seconds: float,
+        retry_max_seconds: float,
+        poll_interval_seconds: float
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+    
+    async def enqueue(self, chargily_data: ChargilyWebhookData) -> bool:
+        """Store a webhook, returns False when the same delivery was already received"""
+        
+        event = ChargilyWebhookEvent(
+            dedup_key=f"{chargily_data.invoice_id}:{chargily_data.status}",
+            invoice_id=chargily_data.invoice_id,
+            chargily_status=chargily_data.status,
+            payload=chargily_data.model_dump()
+        )
+        try:
+            await event.insert()
+        except DuplicateKeyError:
+            return False
+        
+        self._wakeup.set()
+        return True
+    
+    async def start(self) -> None:
+        """Start the worker pool (called from the app lifespan)"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+    
+    async def stop(self) -> None:
+        """Stop the worker pool, claimed events are picked up again after their lease"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _worker(self) -> None:
+        while True:
+            try:
+                drained = await self.drain_batch()
+            except Exception as e:
+                print(f"Error draining webhook inbox: {e}")
+                drained = 0
+            
+            if drained:
+                continue
+            
+            # Idle until a new webhook arrives, polling for expired leases and retries
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _claim_batch(self) -> List[ChargilyWebhookEvent]:
+        """Lease a batch of pending events that are due, including ones whose lease expired"""
+        
+        now = datetime.utcnow()
+        claimable = {
+            "$or": [
+                # Failed attempts wait for their backoff, a missing next_attempt_at is due now
+                {"status": WebhookEventStatus.PENDING, "next_attempt_at": {"$not": {"$gt": now}}},
+                {
+                    "status": WebhookEventStatus.PROCESSING,
+                    "claimed_at": {"$lt": now - timedelta(seconds=self.lease_seconds)}
+                }
+            ]
+        }
+        
+        candidates = await ChargilyWebhookEvent.find(claimable).sort(
+            "received_at"
+        ).limit(self.batch_size).to_list()
+        if not candidates:
+            return []
+        
+        lease_id = uuid.uuid4().hex
+        await ChargilyWebhookEvent.get_pymongo_collection().update_many(
+            {"_id": {"$in": [event.id for event in candidates]}, **claimable},
+            {
+                "$set": {
+                    "status": WebhookEventStatus.PROCESSING,
+                    "lease_id": lease_id,
+                    "claimed_at": now,
+                    "next_attempt_at": None
+                },
+                "$inc": {"attempts": 1}
+            }
+        )
+        
+        # Other workers may have won some of the candidates
+        return await ChargilyWebhookEvent.find({"lease_id": lease_id}).sort("received_at").to_list()
+    
+    def _payment_update(self, payment: Payment, event: ChargilyWebhookEvent, now: datetime) -> UpdateOne:
+        chargily_service = get_chargily_service()
+        new_status = chargily_service.map_chargily_status_to_payment_status(event.chargily_status)
+        new_chargily_status = chargily_service.map_chargily_status_to_chargily_status(event.chargily_status)
+        
+        changes: Dict[str, Any] = {
+            "status": new_status,
+            "chargily_status": new_chargily_status,
+            "chargily_webhook_data": event.payload,
+            "updated_at": now,
+            "last_synced_at": now
+        }
+        if new_status == PaymentStatus.COMPLETED:
+            changes["completed_at"] = now
+        
+        query: Dict[str, Any] = {"_id": payment.id}
+        if new_status in NON_TERMINAL_STATUSES:
+            # A late pending notification must not reopen a finished payment
+            query["status"] = {"$in": NON_TERMINAL_STATUSES}
+        
+        return UpdateOne(query, {"$set": changes})
+    
+    async def drain_batch(self) -> int:
+        """Apply one batch of inbox events to their payments, returns the batch size"""
+        
+        events = await self._claim_batch()
+        if not events:
+            return 0
+        
+        now = datetime.utcnow()
+        payments = await Payment.find(
+            {"chargily_payment_id": {"$in": list({event.invoice_id for event in events})}}
+        ).to_list()
+        payments_by_invoice = {payment.chargily_payment_id: payment for payment in payments}
+        
+        # Events are in arrival order, the latest one per invoice wins
+        latest: Dict[str, ChargilyWebhookEvent] = {}
+        errors: Dict[PydanticObjectId, str] = {}
+        for event in events:
+            if event.invoice_id in payments_by_invoice:
+                latest[event.invoice_id] = event
+            else:
+                errors[event.id] = f"Payment not found for Chargily invoice: {event.invoice_id}"
+        
+        operations = [
+            self._payment_update(payments_by_invoice[invoice_id], event, now)
+            for invoice_id, event in latest.items()
+        ]
+        if operations:
+            try:
+                await Payment.get_pymongo_collection().bulk_write(operations, ordered=False)
+            except Exception as e:
+                for event in events:
+                    errors.setdefault(event.id, f"Failed to update payments: {e}")
+        
+        await self._finish_events(events, errors, now)
+        return len(events)
+    
+    def _retry_delay(self, attempts: int) -> timedelta:
+        """Exponential backoff before the next attempt of a failed event"""
+        delay = self.retry_base_seconds * 2 ** max(attempts - 1, 0)
+        return timedelta(seconds=min(delay, self.retry_max_seconds))
+    
+    async def _finish_events(
+        self,
+        events: List[ChargilyWebhookEvent],
+        errors: Dict[PydanticObjectId, str],
+        now: datetime
+    ) -> None:
+        operations = []
+        for event in events:
+            if event.id not in errors:
+                changes = {"status": WebhookEventStatus.PROCESSED, "processed_at": now}
+            elif event.attempts >= self.max_attempts:
+                changes = {"status": WebhookEventStatus.FAILED, "last_error": errors[event.id]}
+                print(f"Webhook event {event.id} failed after {event.attempts} attempts: {errors[event.id]}")
+            else:
+                changes = {
+                    "status": WebhookEventStatus.PENDING,
+                    "last_error": errors[event.id],
+                    "next_attempt_at": now + self._retry_delay(event.attempts)
+                }
+            
+            operations.append(UpdateOne(
+                {"_id": event.id, "lease_id": event.lease_id},
+                {"$set": {**changes, "lease_id": None}}
+            ))
+        
+        await ChargilyWebhookEvent.get_pymongo_collection().bulk_write(operations, ordered=False)
+    
+    async def replay(self, event_ids: Optional[List[str]] = None) -> int:
+        """Requeue failed events (or the given ones), returns how many were requeued"""
+        
+        if event_ids:
+            invalid = [event_id for event_id in event_ids if not PydanticObjectId.is_valid(event_id)]
+            if invalid:
+                raise exceptions.BadRequest(f"Invalid event IDs: {', '.join(invalid)}")
+            
+            query: Dict[str, Any] = {
+                "_id": {"$in": [PydanticObjectId(event_id) for event_id in event_ids]},
+                "status": {"$ne": WebhookEventStatus.PROCESSING}
+            }
+        else:
+            query = {"status": WebhookEventStatus.FAILED}
+        
+        result = await ChargilyWebhookEvent.get_pymongo_collection().update_many(
+            query,
+            {
+                "$set": {
+                    "status": WebhookEventStatus.PENDING,
+                    "attempts": 0,
+                    "last_error": None,
+                    "next_attempt_at": None
+                },
+                "$unset": {"processed_at": ""}
+            }
+        )
+        
+        self._wakeup.set()
+        return result.modified_count
+
+
+# Global instance
+webhook_inbox = WebhookInbox(
+    workers=settings.webhook_inbox_workers,
+    batch_size=settings.webhook_inbox_batch_size,
+    lease_seconds=settings.webhook_inbox_lease_seconds,
+    max_attempts=settings.webhook_inbox_max_attempts,
+    retry_base_seconds=settings.webhook_inbox_retry_base_seconds,
+    retry_max_seconds=settings.webhook_inbox_retry_max_seconds,
+    poll_interval_seconds=settings.webhook_inbox_poll_interval_seconds
+)
@@ -0,0 +1,164 @@
+from typing import Dict, List, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, SpanExporter
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from pymongo import monitoring
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.config import settings
+
+
+tracer = trace.get_tracer("carvane-ai-backend")
+
+# Filled when TRACING_EXPORTER=memory, to inspect the spans of a run
+memory_exporter: Optional[InMemorySpanExporter] = None
+
+
+def _file_exporter(path: str) -> SpanExporter:
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    
+    # One JSON document per line
+    output = open(path, "a", buffering=1)
+    return ConsoleSpanExporter(
+        out=output,
+        formatter=lambda span: span.to_json(indent=None) + "\n"
+    )
+
+
+def setup_tracing() -> None:
+    """Install the tracer provider configured in the settings"""
+    global memory_exporter
+    
+    if settings.tracing_exporter == "none":
+        return
+    
+    provider = TracerProvider(
+        resource=Resource.create({
+            "service.name": settings.tracing_service_name,
+            "service.version": settings.app_version,
+        }),
+        sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio)),
+    )
+    
+    if settings.tracing_exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider.add_span_processor(
+            BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint))
+        )
+    elif settings.tracing_exporter == "file":
+        provider.add_span_processor(BatchSpanProcessor(_file_exporter(settings.tracing_file_path)))
+    elif settings.tracing_exporter == "memory":
+        memory_exporter = InMemorySpanExporter()
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    else:
+        raise ValueError(f"Unknown tracing exporter: {settings.tracing_exporter}")
+    
+    trace.set_tracer_provider(provider)
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans"""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+def span_tree(spans: List[ReadableSpan]) -> List[dict]:
+    """Nest finished spans under their parents, e.g. to check the spans of a chat turn"""
+    
+    nodes: Dict[int, dict] = {
+        span.context.span_id: {"name": span.name, "attributes": dict(span.attributes or {}), "children": []}
+        for span in spans
+    }
+    roots = []
+    for span in sorted(spans, key=lambda span: span.start_time or 0):
+        node = nodes[span.context.span_id]
+        parent = nodes.get(span.parent.span_id) if span.parent else None
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["children"].append(node)
+    return roots
+
+
+def inject_trace_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Headers carrying the current trace context to a downstream service"""
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+class TracingMiddleware:
+    """Server span for each request, continuing the caller's trace when it sends one"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method, path = scope["method"], scope["path"]
+        parent = propagate.extract(Headers(scope=scope))
+        with tracer.start_as_current_span(
+            f"{method} {path}",
+            context=parent,
+            kind=trace.SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": path},
+        ) as span:
+            async def send_with_status(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(trace.Status(trace.StatusCode.ERROR))
+                await send(message)
+            
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Name the span after the route template once the router has matched it
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
+
+
+class MongoTracingListener(monitoring.CommandListener):
+    """Client span for each Mongo command, the ones Beanie sends included"""
+    
+    def __init__(self):
+        self._spans: Dict[tuple, trace.Span] = {}
+    
+    def _key(self, event) -> tuple:
+        return (event.connection_id, event.request_id)
+    
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        collection = event.command.get(event.command_name)
+        span = tracer.start_span(
+            f"mongo {event.command_name}",
+            kind=trace.SpanKind.CLIENT,
+            attributes={
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": collection if isinstance(collection, str) else "",
+            },
+        )
+        self._spans[self._key(event)] = span
+    
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        span = self._spans.pop(self._key(event), None)
+        if span is not None:
+            span.end()
+    
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        span = self._spans.pop(self._key(event), None)
+        if span is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(event.failure)))
+            span.end()
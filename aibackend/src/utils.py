@@ -1,5 +1,13 @@
-from fastapi import UploadFile
-from typing import Dict, List
+import asyncio
+import base64
+import hashlib
+import json
+from datetime import datetime
+from bson import ObjectId
+from fastapi import Request, UploadFile
+from typing import Any, Awaitable, BinaryIO, Dict, List, Optional, Tuple, TypeVar
+
+from src.exception import exceptions
 
 
 def check_extension(file: UploadFile, allowed_extensions: Dict[str, List[str]]) -> bool:
@@ -8,29 +16,119 @@ def check_extension(file: UploadFile, allowed_extensions: Dict[str, List[str]])
     if not file.filename:
         return False
     
+    return is_allowed_file(file.filename, file.content_type, allowed_extensions)
+
+
+def is_allowed_file(
+    filename: str,
+    content_type: Optional[str],
+    allowed_extensions: Dict[str, List[str]]
+) -> bool:
+    """Check a filename and content type against the allowed extensions"""
+    
     # Get file extension
-    file_extension = file.filename.split('.')[-1].lower()
+    file_extension = filename.split('.')[-1].lower()
     
     # Check if extension is in allowed list
     if file_extension not in allowed_extensions:
         return False
     
     # Check content type if available
-    if file.content_type:
+    if content_type:
         allowed_content_types = allowed_extensions[file_extension]
-        if file.content_type not in allowed_content_types:
+        if content_type not in allowed_content_types:
             return False
     
     return True
 
 
-def validate_file_size(file: UploadFile, max_size_mb: int = 10) -> bool:
-    """Validate file size"""
+class SizeLimitedReader:
+    """File wrapper that fails once more than max_size bytes have been read"""
     
-    # Note: This is a basic check. For production, you might want to read the file
-    # and check its actual size, but that would require reading the entire file.
-    # For now, we'll assume the file size is reasonable.
-    return True
+    def __init__(self, file: BinaryIO, max_size: int):
+        self.file = file
+        self.max_size = max_size
+        self.bytes_read = 0
+    
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_size:
+            raise exceptions.PayloadTooLarge(f"File is larger than {self.max_size // (1024 * 1024)} MB")
+        return data
+
+
+class HashingReader(SizeLimitedReader):
+    """SizeLimitedReader that computes the SHA-256 of what goes through it"""
+    
+    def __init__(self, file: BinaryIO, max_size: int):
+        super().__init__(file, max_size)
+        self.digest = hashlib.sha256()
+    
+    def read(self, size: int = -1) -> bytes:
+        data = super().read(size)
+        self.digest.update(data)
+        return data
+
+
+def get_file_size(file: UploadFile) -> Optional[int]:
+    """Size of an uploaded file, without reading it"""
+    
+    if file.size is not None:
+        return file.size
+    
+    # Uploads are spooled to a seekable file
+    if file.file.seekable():
+        position = file.file.tell()
+        size = file.file.seek(0, 2)
+        file.file.seek(position)
+        return size - position
+    
+    return None
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range HTTP Range header into inclusive (start, end) offsets
+    
+    Returns None when the whole object should be served (no header, malformed or
+    multi-range), raises ValueError when the range can't be satisfied.
+    """
+    
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header or size == 0:
+        return None
+    
+    start_str, separator, end_str = range_header[len("bytes="):].strip().partition("-")
+    if not separator or not all(part.isdigit() or part == "" for part in (start_str, end_str)):
+        return None
+    
+    if not start_str:
+        # Suffix range: the last N bytes
+        if not end_str:
+            return None
+        suffix = int(end_str)
+        if suffix == 0:
+            raise ValueError(f"Range not satisfiable: {range_header}")
+        return max(size - suffix, 0), size - 1
+    
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range not satisfiable: {range_header}")
+    
+    return start, min(end, size - 1)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)"""
+    
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    
+    etag = etag.strip('"')
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return any(candidate.removeprefix("W/").strip('"') == etag for candidate in candidates)
 
 
 def sanitize_filename(filename: str) -> str:
@@ -48,3 +146,71 @@ def sanitize_filename(filename: str) -> str:
     filename = filename.strip('_.')
     
     return filename
+
+
+T = TypeVar("T")
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its request was answered"""
+
+
+async def run_until_disconnected(request: Request, work: Awaitable[T], poll_interval: float = 0.5) -> T:
+    """Run work in a task, cancelling it as soon as the client disconnects"""
+    
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Events frame"""
+    
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def encode_cursor(created_at: datetime, document_id: Any) -> str:
+    """Build an opaque continuation token from the last item of a page"""
+    
+    raw = json.dumps({"c": created_at.isoformat(), "i": str(document_id)})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Any]:
+    """Decode a continuation token, raises ValueError when it is malformed"""
+    
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        created_at = datetime.fromisoformat(data["c"])
+        document_id = data["i"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    
+    return created_at, ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+
+
+def keyset_filter(cursor: str, id_field: str = "_id") -> Dict[str, Any]:
+    """Filter matching the items after a cursor, ordered by (created_at, id_field) descending
+    
+    id_field must hold values of a single BSON type, $lt doesn't compare across types.
+    """
+    
+    created_at, document_id = decode_cursor(cursor)
+    return {
+        "created_at": {"$lte": created_at},
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, id_field: {"$lt": document_id}}
+        ]
+    }
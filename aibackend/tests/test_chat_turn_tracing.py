@@ -0,0 +1,113 @@
+"""Span tree of a chat turn, run against the Mongo at MONGODB_URL (skipped when unreachable)
+
+The LLM is replaced by a canned chat model, everything else, persistence included, is real.
+"""
+import asyncio
+import uuid
+from typing import List, Optional
+
+import pytest
+from beanie import PydanticObjectId, init_beanie
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+from src import tracing
+from src.config import settings
+from src.models.conversation import Conversation, Message
+from src.models.response_cache import CachedResponse
+from src.services.llm_registry import llm_registry
+
+
+class StubChatModel(FakeListChatModel):
+    """Canned chat model with the attributes the agent reads from ChatOpenAI"""
+    model_name: str = "stub"
+    temperature: float = 0.0
+    max_tokens: Optional[int] = None
+
+
+def names(nodes: List[dict]) -> List[str]:
+    return [node["name"] for node in nodes]
+
+
+@pytest.fixture(scope="module")
+def memory_exporter():
+    settings.tracing_exporter = "memory"
+    settings.tracing_sample_ratio = 1.0
+    if tracing.memory_exporter is None:
+        tracing.setup_tracing()
+    return tracing.memory_exporter
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    monkeypatch.setattr(settings, "ai_cache_enabled", False)
+    monkeypatch.setattr(
+        llm_registry,
+        "get",
+        lambda model, temperature=None, max_tokens=None: StubChatModel(
+            responses=["Nous sommes ouverts de 11h à 23h."], model_name=model
+        )
+    )
+
+
+async def run_turn(conversation_id: str, message: str):
+    from src.services.ai_agent_service import AIAgentService
+
+    client = AsyncMongoClient(
+        settings.mongodb_url,
+        serverSelectionTimeoutMS=1000,
+        event_listeners=[tracing.MongoTracingListener()]
+    )
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        await client.close()
+        pytest.skip(f"MongoDB is not reachable: {e}")
+
+    database = client[f"{settings.mongodb_database}_test_{uuid.uuid4().hex[:8]}"]
+    try:
+        await init_beanie(database=database, document_models=[Conversation, Message, CachedResponse])
+        service = AIAgentService()
+
+        # Only the spans of the turn itself
+        tracing.memory_exporter.clear()
+        reply = await service.process_message(conversation_id, message, "test-user", "test-restaurant")
+        return reply, list(tracing.memory_exporter.get_finished_spans())
+    finally:
+        await client.drop_database(database.name)
+        await client.close()
+
+
+def test_chat_turn_span_tree(memory_exporter, stub_llm):
+    conversation_id = str(PydanticObjectId())
+    reply, spans = asyncio.run(run_turn(conversation_id, "Bonjour, quels sont vos horaires ?"))
+    assert reply.response == "Nous sommes ouverts de 11h à 23h."
+
+    roots = tracing.span_tree(spans)
+    assert names(roots) == ["agent.turn"]
+    turn = roots[0]
+    assert turn["attributes"]["agent.conversation_id"] == conversation_id
+
+    # The conversation is read before the graph runs, the turn is written after it
+    children = turn["children"]
+    graph_index = names(children).index("agent.graph")
+    before = [child for child in children[:graph_index] if child["name"].startswith("mongo ")]
+    after = [child for child in children[graph_index + 1:] if child["name"].startswith("mongo ")]
+    assert ("mongo find", "conversations") in [
+        (span["name"], span["attributes"]["db.mongodb.collection"]) for span in before
+    ]
+    assert ("mongo insert", "messages") in [
+        (span["name"], span["attributes"]["db.mongodb.collection"]) for span in after
+    ]
+    assert ("mongo update", "conversations") in [
+        (span["name"], span["attributes"]["db.mongodb.collection"]) for span in after
+    ]
+    assert all(child["name"].startswith("mongo ") for child in children if child["name"] != "agent.graph")
+
+    # Nodes run in order under the graph, the LLM call under its handler
+    graph = children[graph_index]
+    assert names(graph["children"]) == ["agent.analyze_input", "agent.handle_general", "agent.generate_response"]
+    handler = graph["children"][1]
+    assert handler["attributes"]["agent.task"] == "general"
+    assert names(handler["children"]) == ["openai chat"]